@@ -1,7 +1,17 @@
-import numpy as np
+from pathlib import Path
+import sys
+
 import time
 
+# The surface code modules and their data are in the package directory, the
+# script runs from anywhere
+PACKAGE_DIR = Path(__file__).resolve().parent / "sola_board_game"
+sys.path.insert(0, str(PACKAGE_DIR))
+
 import buttons
+from lookup import SyndromeLookup
+from sample_store import SampleStore
+from syndromes import rounds_to_colors
 import twpa
 import pygame
 import board
@@ -105,6 +115,7 @@ red_gradients = [(255//3, 0//4, 0//4)]*64
 COLOR_Z_AUX_QB = green_gradients[10]
 COLOR_X_AUX_QB = blue_gradients[20]
 COLOR_DATA_QB = (255//3, 0//4, 0//4)
+AUX_QB_COLORS = [COLOR_Z_AUX_QB]*(N_AUX_QBS//2) + [COLOR_X_AUX_QB]*(N_AUX_QBS//2)
 
 
 # initialize pixels
@@ -127,10 +138,12 @@ pixels = neopixel.NeoPixel(
 current_frame = 0
 
 def load_samples(file_path, display=False):
-    data = np.load(file_path, allow_pickle=True)
-    samples = {int(seed): data[seed].item() for seed in data.files}
+    # Memory-mapped, samples are only read when they are used. Convert
+    # pickled npz samples with sample_store.py.
+    samples = SampleStore(file_path)
     if display:
-        for seed, data in samples.items():
+        for seed in range(len(samples)):
+            data = samples[seed]
             print(f"Seed {seed}:")
             print("Syndromes:", data['syndromes'])
             print("Data qubits:", data['data_qubits'])
@@ -154,8 +167,6 @@ def choose_sample(samples, current_round):
     return samples[sample_index]
 
 def display_syndrome(sample, current_round, colors=None, bypass_buttons=False):
-    if colors is None:
-        colors = [COLOR_Z_AUX_QB]*4 + [COLOR_X_AUX_QB]*4
 
     print(f"Displaying sample {current_round}")
     # while True:
@@ -175,9 +186,14 @@ def display_syndrome(sample, current_round, colors=None, bypass_buttons=False):
     #
     # # Display syndromes on NeoPixels
     frame = 0
-    for i in range(0, len(sample['syndromes']), N_AUX_QBS):
-        syndrome_slice = sample['syndromes'][i:i + N_AUX_QBS]
-        light_neopixels(syndrome_slice, colors)
+    # Colours of all rounds at once, (n_rounds, N_AUX_QBS, 3)
+    if colors is None:
+        frames = lut.round_colors(sample['packed_syndromes'])
+    else:
+        frames = rounds_to_colors(sample['packed_syndromes'], colors, N_AUX_QBS)
+    for packed_round, round_colors in zip(sample['packed_syndromes'], frames):
+        print(lut.round_hint(packed_round))
+        light_neopixels(round_colors)
         pixels.show()
         # if bypass_buttons:
         #     frame_update = 'next'
@@ -207,13 +223,10 @@ def display_syndrome(sample, current_round, colors=None, bypass_buttons=False):
     #
     # return False  # Unsuccessful display
 
-def light_neopixels(syndrome_slice, colors):
-    # Adjust this function based on your actual NeoPixel setup
-    for i in range(min(len(syndrome_slice), NEOPIXEL_COUNT)):
-        if syndrome_slice[i]:
-            pixels[i] = colors[i]  # Turn on NeoPixel
-        else:
-            pixels[i] = (0, 0, 0)  # Turn off NeoPixel
+def light_neopixels(round_colors):
+    # One slice write of the whole round, see syndromes.rounds_to_colors
+    n = min(len(round_colors), NEOPIXEL_COUNT)
+    pixels[:n] = round_colors[:n].tolist()
 
 def display_logical_operator_prompt():
     print("Do you want to flip the logical operator? (Press 'left' to decline, 'right' to accept)")
@@ -249,9 +262,11 @@ while not (TWPA_CALIBRATED or twpa.check_twpa_bypass()):
 print('Starting surface code game...')
 playing = True
 print('Loading samples...')
-# Assume your samples are loaded in the following format:
-# samples = {0: {'syndromes': [...], 'data_qubits': [...], 'log_op': ...}, 1: {...}, ...}
-samples = load_samples("samples.npz")
+# samples[i] = {'syndromes': [...], 'data_qubits': [...], 'log_op': ..., 'log_op_init': ...}
+samples = load_samples(str(PACKAGE_DIR / "samples.sst"))
+# Colours, hints and decoded answers, built on the first run then
+# memory-mapped
+lut = SyndromeLookup(DISTANCE, AUX_QB_COLORS, str(PACKAGE_DIR / f"syndrome_lut_d{DISTANCE}.npy"), store=samples)
 current_round = 1
 score = 0
 streak = 0
@@ -261,6 +276,8 @@ n_rounds = 15
 while playing:
     print(f'Round {current_round}')
     sample = choose_sample(samples, current_round)
+    expected_flip = lut.sample_flip(sample['index'])
+    print(f"Hint: {'flip' if expected_flip else 'keep'} the logical operator")
     success = display_syndrome(sample, current_round)
     current_round += 1
     # score += success
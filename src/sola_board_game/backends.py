@@ -0,0 +1,89 @@
+"""
+Hardware backends of the PhD hat.
+
+``HardwareBackend`` builds the real devices (Blinka pins, SSD1306 over I2C,
+NeoPixels, gpiozero distance sensor); its imports are deferred so that this
+module loads on any machine, and quickly. ``simulation.SimBackend`` builds
+simulated devices with the same interface so the game runs headless, e.g. on
+a CI machine.
+
+Pins are named like the ``board`` attributes ("D5", "D13", ...).
+
+Each backend owns the ``clock`` of the game: pauses, timeouts and timers of
+the stages are in its seconds, so a simulated game can run faster than real
+time.
+"""
+import time
+
+PULL_UP = "up"
+PULL_DOWN = "down"
+
+
+class Clock:
+    """
+    Game time, ``speed`` times faster than real time.
+    """
+
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self._start = time.monotonic()
+
+    def monotonic(self):
+        """Game seconds, like time.monotonic()."""
+        return self._start + (time.monotonic() - self._start) * self.speed
+
+    def real(self, seconds):
+        """Real seconds of game seconds, e.g. for an asyncio timeout."""
+        return seconds / self.speed
+
+    def sleep(self, seconds):
+        time.sleep(seconds / self.speed)
+
+
+class HardwareBackend:
+    """Real devices on the Raspberry Pi."""
+
+    def __init__(self):
+        self.clock = Clock()
+
+    def pin(self, pin_name, pull=PULL_UP, name=None):
+        """
+        Digital input.
+        :param pin_name: board pin, e.g. "D5"
+        :param pull: PULL_UP or PULL_DOWN
+        :param name: input name in the game, unused on hardware
+        """
+        import board
+        from digitalio import DigitalInOut, Direction, Pull
+
+        io = DigitalInOut(getattr(board, pin_name))
+        io.direction = Direction.INPUT
+        io.pull = Pull.UP if pull == PULL_UP else Pull.DOWN
+        return io
+
+    def display(self, width, height):
+        import adafruit_ssd1306
+        import board
+        import busio
+
+        # Create the I2C interface.
+        self.i2c = busio.I2C(board.SCL, board.SDA)
+        # Create the SSD1306 OLED class.
+        return adafruit_ssd1306.SSD1306_I2C(width, height, self.i2c)
+
+    def pixels(self, pin_name, count, brightness, pixel_order):
+        import board
+        import neopixel
+
+        return neopixel.NeoPixel(
+            getattr(board, pin_name),
+            count,
+            brightness=brightness,
+            auto_write=False,
+            pixel_order=getattr(neopixel, pixel_order),
+        )
+
+    def distance_sensor(self, echo, trigger):
+        from gpiozero import DistanceSensor
+
+        return DistanceSensor(echo=echo, trigger=trigger)
@@ -0,0 +1,402 @@
+"""
+End-to-end benchmark of the game loop on the simulated hat.
+
+Each scenario runs a stage of PhDHat on a SimBackend, driven by a scripted
+input trace, and reports:
+- render time of each frame request (plot update, text drawing, packing and
+  transfer), in ms
+- data bytes sent to the display per transfer
+- LED strip show() count
+- latency from an input change to the next display transfer, in ms
+
+The "pack" scenario compares the conversion of frames to the SSD1306 page
+layout by display.pack_image() with the driver's image(), which sets one
+pixel at a time. adafruit_framebuf is used if installed, otherwise a copy of
+its loop. The "atlas" scenario compares the static screens drawn from the
+glyph atlas with ImageDraw.text.
+
+Usage, from this directory:
+    python benchmark.py                      # all scenarios
+    python benchmark.py bio --out new.json   # save the results
+    python benchmark.py --compare old.json   # compare with a previous run
+"""
+import argparse
+import asyncio
+import functools
+import json
+import platform
+import time
+
+import numpy as np
+from PIL import ImageDraw
+
+import bio
+from display import pack_image
+from fonts import FontCache
+import phdhat
+from simulation import SimBackend
+from engine import StageRunner
+from inputs import PRESS
+
+PERCENTILES = (50, 95, 99)
+
+
+def press(at, name, duration=0.1):
+    """Script entries pressing an active low button for ``duration`` s."""
+    return [(at, name, False), (at + duration, name, None)]
+
+
+def bypass(at, duration=0.3):
+    """Script entries pressing A and B together."""
+    return press(at, "a", duration) + press(at, "b", duration)
+
+
+class Probe:
+    """
+    Times calls of wrapped functions. Nested calls of wrapped functions are
+    part of the outermost call, so each entry is one frame request.
+    """
+
+    def __init__(self):
+        # (start time, duration) of the outermost calls
+        self.calls = []
+        self._depth = 0
+        self._wrapped = []
+
+    def wrap(self, owner, name):
+        """Time owner.name, owner is an instance or a class."""
+        func = getattr(owner, name)
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            self._depth += 1
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._depth -= 1
+                if not self._depth:
+                    self.calls.append((start, time.perf_counter() - start))
+
+        # Class attributes are restored to the original, instance ones deleted
+        self._wrapped.append((owner, name, owner.__dict__.get(name)))
+        setattr(owner, name, timed)
+
+    def restore(self):
+        for owner, name, original in reversed(self._wrapped):
+            if original is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+        self._wrapped = []
+
+
+def summary(values):
+    """Mean, max and percentiles of a list of numbers, None if empty."""
+    if not len(values):
+        return None
+    values = np.asarray(values, dtype=float)
+    result = {"mean": float(values.mean()), "max": float(values.max())}
+    for q, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        result[f"p{q}"] = float(value)
+    return result
+
+
+def input_latencies(applied, writes):
+    """
+    Time from each input change to the first display transfer after it.
+    Releases (value None) are not counted. An input followed by another one
+    before any transfer (e.g. a press at the end of the scale) has no
+    latency, it is counted as without transfer.
+    :return: list of latencies in s, number of inputs without a transfer
+    """
+    write_times = np.array([t for t, _ in writes])
+    changes = sorted(at for at, _, value in applied if value is not None)
+    latencies = []
+    missed = 0
+    for at, next_at in zip(changes, changes[1:] + [np.inf]):
+        idx = np.searchsorted(write_times, at)
+        if idx == len(write_times) or write_times[idx] > next_at:
+            missed += 1
+        else:
+            latencies.append(write_times[idx] - at)
+    return latencies, missed
+
+
+async def surface_cycles(hat, score=3, n_rounds=5, streak=2):
+    """Surface code board display, L/R scrolls through the cycles."""
+    cycle = 0
+    hat.listen("l", "r")
+    hat._display_surface_board_cycle(score, n_rounds, streak, cycle)
+    while not hat.check_bypasses():
+        event = await hat.next_event()
+        if event.kind == PRESS and event.name in ("l", "r"):
+            cycle += 1 if event.name == "r" else -1
+            hat._display_surface_board_cycle(score, n_rounds, streak, cycle)
+
+
+def bio_scenario(hat):
+    script = []
+    # FreqPlot game, after the 3 s intro
+    t = 3.5
+    for name in "uurddluurdd":
+        script += press(t, name)
+        t += 0.25
+    script += bypass(t)
+    # NoisePlot game, after the 2 s pause, u/d are held to repeat
+    t += 2.8
+    for name, duration in [("r", 0.1), ("u", 0.8), ("r", 0.1), ("r", 0.1), ("d", 0.8), ("l", 0.1), ("u", 0.4)]:
+        script += press(t, name, duration)
+        t += duration + 0.2
+    script += bypass(t)
+    return hat.bio_stage, (), script
+
+
+def three_di_scenario(hat):
+    script = [(3.5, "distance", 0.26), (5.0, "distance", 0.40), (5.6, "distance", 0.27),
+              (6.5, "distance", 0.255), (7.4, "distance", 0.12)]
+    script += bypass(8.0)
+    return hat.three_di_stage, (), script
+
+
+def surface_scenario(hat):
+    script = []
+    t = 0.5
+    for name in "rrrrlrrlll":
+        script += press(t, name)
+        t += 0.2
+    script += bypass(t)
+
+    async def surface_stage():
+        await surface_cycles(hat)
+    return surface_stage, (), script
+
+
+SCENARIOS = {
+    "bio": bio_scenario,
+    "three_di": three_di_scenario,
+    "surface": surface_scenario,
+}
+
+
+def stock_image(image, buf):
+    """
+    Same conversion as adafruit_framebuf.FrameBuffer.image() in MVLSB format,
+    the one of the SSD1306 driver.
+    """
+    width, height = image.size
+    pixels = image.load()
+    for i in range(len(buf)):
+        buf[i] = 0
+    for x in range(width):
+        for y in range(height):
+            if pixels[(x, y)]:
+                index = (y >> 3) * width + x
+                offset = y & 0x07
+                buf[index] = (buf[index] & ~(0x01 << offset)) | (1 << offset)
+
+
+def pack_frames():
+    """Canvases of the static screens and of the bio plots, as shown in the game."""
+    hat = phdhat.PhDHat(backend=SimBackend(keep_frames=False), screen_cache=None)
+    frames = []
+    for text in phdhat.STATIC_SCREENS:
+        hat._display_text_on_screen(text)
+        frames.append(hat.fb.image.copy())
+    freq_plot = bio.FreqPlot(w=hat.disp_width, h=hat.disp_height, buffer=16, nb_pts=3)
+    noise_plot = bio.NoisePlot(w=hat.disp_width, h=hat.disp_height, buffer=16, nb_pts=14)
+    frames += [freq_plot.main_img.copy(), noise_plot.main_img.copy()]
+    return frames
+
+
+def pack_scenario(repeat=20):
+    """:return: results of the page conversion, in us per frame"""
+    frames = pack_frames()
+    buf = bytearray(len(pack_image(frames[0])))
+    try:
+        import adafruit_framebuf
+        framebuf = adafruit_framebuf.FrameBuffer(buf, *frames[0].size, adafruit_framebuf.MVLSB)
+        stock, stock_name = framebuf.image, "adafruit_framebuf"
+    except ImportError:
+        stock, stock_name = functools.partial(stock_image, buf=buf), "copy of adafruit_framebuf"
+
+    stock_us, packed_us = [], []
+    for image in frames:
+        stock(image)
+        if pack_image(image) != bytes(buf):
+            raise AssertionError("pack_image() differs from the driver")
+        for times, convert in ((stock_us, stock), (packed_us, pack_image)):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                convert(image)
+            times.append(1e6 * (time.perf_counter() - start) / repeat)
+    print(f"Stock conversion: {stock_name}")
+    return {
+        "frames": len(frames),
+        "stock_us": summary(stock_us),
+        "pack_image_us": summary(packed_us),
+        "speedup": round(float(np.mean(stock_us) / np.mean(packed_us)), 1),
+    }
+
+
+def atlas_scenario(repeat=20):
+    """
+    Static screens drawn from the glyph atlas and by ImageDraw.text, as
+    _display_text_on_screen() draws them, must be the same pixels.
+    :return: results of the text drawing, in us per screen
+    """
+    fonts = FontCache(phdhat.FONTPATH)
+    hat = phdhat.PhDHat(backend=SimBackend(keep_frames=False), screen_cache=None)
+    size = hat.font_size
+    position = (hat.disp_width / 2, hat.disp_height / 2)
+    atlas_image = hat.fb.image.copy()
+    pil_image = hat.fb.image.copy()
+    atlas_draw, pil_draw = ImageDraw.Draw(atlas_image), ImageDraw.Draw(pil_image)
+    font = fonts.get(size)
+
+    def draw_atlas(text):
+        fonts.draw_text(atlas_draw, position, text, size=size, anchor="mm", fill=1)
+
+    def draw_pil(text):
+        pil_draw.text(position, text, font=font, anchor="mm", fill=1)
+
+    atlas_us, pil_us = [], []
+    for text in phdhat.STATIC_SCREENS:
+        for image in (atlas_image, pil_image):
+            image.paste(0, (0, 0, *image.size))
+        draw_atlas(text)
+        draw_pil(text)
+        if atlas_image.tobytes() != pil_image.tobytes():
+            raise AssertionError(f"Glyph atlas differs from ImageDraw.text for {text!r}")
+        for times, draw in ((atlas_us, draw_atlas), (pil_us, draw_pil)):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                draw(text)
+            times.append(1e6 * (time.perf_counter() - start) / repeat)
+    if fonts.atlas_misses:
+        raise AssertionError(f"{fonts.atlas_misses} static screens not covered by the glyph atlas")
+    return {
+        "screens": len(phdhat.STATIC_SCREENS),
+        "imagedraw_us": summary(pil_us),
+        "atlas_us": summary(atlas_us),
+        "speedup": round(float(np.mean(pil_us) / np.mean(atlas_us)), 1),
+    }
+
+
+def run_scenario(name, speed=1.0):
+    """
+    Run one scenario on a fresh simulated hat.
+    :param speed: speed of the simulated game and its input script
+    :return: dict of results
+    """
+    backend = SimBackend(keep_frames=False, speed=speed)
+    hat = phdhat.PhDHat(backend=backend)
+    # Measure the stage only, not the start up of the devices
+    hat.devices.join()
+    stage, args, script = SCENARIOS[name](hat)
+
+    probe = Probe()
+    for attr in ("_display_text_on_screen", "_display_surface_board_cycle"):
+        probe.wrap(hat, attr)
+    probe.wrap(hat.fb, "show_image")
+    probe.wrap(hat.fb, "flush")
+    for cls in (bio.FreqPlot, bio.NoisePlot):
+        probe.wrap(cls, "update_graph_plot")
+
+    runner = StageRunner(hat)
+    runner.add_stage(stage, *args)
+    writes_before = len(backend.disp.writes)
+    shows_before = backend.strip.shows
+    start = time.monotonic()
+    try:
+        backend.play(script)
+        asyncio.run(runner.run())
+    finally:
+        probe.restore()
+        hat.inputs.stop()
+        hat.leds.stop()
+    duration = time.monotonic() - start
+
+    writes = backend.disp.writes[writes_before:]
+    latencies, missed = input_latencies(backend.applied, writes)
+    return {
+        "duration_s": duration,
+        "frames": len(writes),
+        "render_ms": summary([1e3 * d for _, d in probe.calls]),
+        "bytes_per_frame": summary([n for _, n in writes]),
+        "bytes_total": sum(n for _, n in writes),
+        "led_shows": backend.strip.shows - shows_before,
+        "inputs": len([entry for entry in backend.applied if entry[2] is not None]),
+        "inputs_without_frame": missed,
+        "latency_ms": summary([1e3 * latency for latency in latencies]),
+    }
+
+
+def flatten(results):
+    """{scenario: {metric: value or {stat: value}}} -> {"scenario.metric.stat": value}"""
+    flat = {}
+    for scenario, metrics in results.items():
+        for metric, value in metrics.items():
+            if value is None:
+                continue
+            if isinstance(value, dict):
+                for stat, v in value.items():
+                    flat[f"{scenario}.{metric}.{stat}"] = v
+            else:
+                flat[f"{scenario}.{metric}"] = value
+    return flat
+
+
+def print_results(results, baseline=None):
+    new = flatten(results)
+    old = flatten(baseline) if baseline is not None else {}
+    for key, value in new.items():
+        line = f"{key:36s} {value:>12.4g}"
+        if old.get(key) is not None:
+            line += f"   was {old[key]:>12.4g}"
+            if old[key]:
+                line += f" {100 * (value - old[key]) / old[key]:+.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PhD hat game loop benchmark")
+    parser.add_argument("scenarios", nargs="*", help=f"scenarios to run, all by default: {', '.join(SCENARIOS)}, pack, atlas")
+    parser.add_argument("--speed", type=float, default=1.0, help="speed of the simulated game and its input scripts")
+    parser.add_argument("--out", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of a previous run to compare with")
+    args = parser.parse_args()
+
+    for name in args.scenarios:
+        if name not in SCENARIOS and name not in ("pack", "atlas"):
+            parser.error(f"unknown scenario {name}")
+
+    results = {}
+    for name in args.scenarios or [*SCENARIOS, "pack", "atlas"]:
+        print(f"Running {name}...")
+        if name == "pack":
+            results[name] = pack_scenario()
+        elif name == "atlas":
+            results[name] = atlas_scenario()
+        else:
+            results[name] = run_scenario(name, speed=args.speed)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({
+                "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "machine": platform.node(),
+                "python": platform.python_version(),
+                "speed": args.speed,
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 import numpy as np
 from PIL import ImageDraw, Image, ImageFont
 
+import metrics
+
 
 class Plot:
     def __init__(self, w, h, buffer, nb_pts):
@@ -14,6 +16,8 @@ class Plot:
 
         self.marker = 0
         self.values = None
+        # Box of main_img changed since the last take_dirty(), None if clean
+        self.dirty_box = None
 
     def update_marker(self, mark_step):
         self.marker += mark_step
@@ -22,15 +26,32 @@ class Plot:
     def update_value(self, value_step, update=True):
         self.values[self.marker] = round(self.values[self.marker] + value_step, 1)
         if update:
-            self.update_graph_plot()
+            self.update_graph_plot(columns=[self.marker])
 
-    def update_graph_plot(self):
+    def update_graph_plot(self, columns=None):
         """
         Define in childs
+        :param columns: indices of the values that changed, None for all
         :return: Nothing
         """
         pass
 
+    def mark_dirty(self, box):
+        """Add box (x0, y0, x1, y1), x1/y1 exclusive, to the dirty box."""
+        if self.dirty_box is None:
+            self.dirty_box = box
+        else:
+            self.dirty_box = (min(self.dirty_box[0], box[0]), min(self.dirty_box[1], box[1]),
+                              max(self.dirty_box[2], box[2]), max(self.dirty_box[3], box[3]))
+
+    def take_dirty(self):
+        """
+        :return: box of main_img changed since the last call, None if nothing
+        changed. Meant to be passed to FrameBuffer.show_image.
+        """
+        box, self.dirty_box = self.dirty_box, None
+        return box
+
     def build_ylabel(self, text):
         # Create Y-label (rotation seem to only be possible for images, so do it in a weird way)
         ylabel_img = Image.new("1", (self.h, self.buffer))  # diminsions exchange dueto upcomming rotation
@@ -42,14 +63,37 @@ class Plot:
 
 
 class FreqPlot(Plot):
-    def __init__(self, w, h, buffer, nb_pts):
+    """
+    Qubit frequency plot, one column per qubit.
+
+    The plot is retained: the static frame and the |D>/|B> sprites are built
+    once, and an update only re-renders the columns whose value changed
+    (plus their neighbours, which share a divider line, and the first two
+    columns when the hybridization overlay appears, moves or disappears).
+    """
+
+    def __init__(self, w, h, buffer, nb_pts, values=None, labels=None):
         super().__init__(w, h, buffer, nb_pts)
 
-        self.values = [0.1, 0.8, 0.3]
-        self.labels = ['q1', 'q2', 'q3']
+        if values is None:
+            values = [0.1, 0.8, 0.3] if nb_pts == 3 else [0.5] * nb_pts
+        if labels is None:
+            labels = [f'q{qb + 1}' for qb in range(nb_pts)]
+        self.values = list(values)
+        self.labels = list(labels)
         self.hybridization = 0.3
 
+        # Plot geometry
+        self.pw = self.w - self.buffer
+        self.ph = self.h - self.buffer
+        self.qb_width = self.pw / self.nb_pts
+        self.qb_bar_width = 5
+
         self.build_main_frame()
+        self.build_sprites()
+        self.plot_img = self.static_plot.copy()
+        # Whether the |D>/|B> overlay is currently drawn, and at which value
+        self.shown_hybridization = None
         self.update_graph_plot()
 
     def build_main_frame(self):
@@ -65,62 +109,108 @@ class FreqPlot(Plot):
         # ylabel_img = ylabel_img.rotate(90, expand=True)
         self.main_img.paste(ylabel_img, (0, - int(0.5 * self.buffer)))
 
-    # def update_freq(self, freq_step):
-    #     self.freqs[self.marker] = round(self.freqs[self.marker] + freq_step, 1)
-    #     self.update_freq_plot()
-
-    def update_graph_plot(self):
-        # Prepare the plot part of the img
-        pw = self.w - self.buffer
-        ph = self.h - self.buffer
-        qb_width = pw / self.nb_pts
-        qb_bar_width = 5
+    def build_sprites(self):
+        pw, ph = self.pw, self.ph
+        qb_width = self.qb_width
+        qb_bar_width = self.qb_bar_width
 
-        plot_img = Image.new("1", (pw, ph))
-        plot_draw = ImageDraw.Draw(plot_img)
-
-        # Clear the plot
+        # Static part of the plot: border and a big rect for each qubit
+        self.static_plot = Image.new("1", (pw, ph))
+        plot_draw = ImageDraw.Draw(self.static_plot)
         plot_draw.rectangle((0, 0, pw, ph), fill=0, outline=1)
-
-        # Draw a big rect for each qubit
         for qb in range(self.nb_pts):
             plot_draw.rectangle((qb * qb_width, 0, (qb + 1) * qb_width, ph), fill=0, outline=1)
 
-        # Now insert a qb bar for each qubit
-        plot_draw.rectangle((0, self.values[0] * ph, qb_width, self.values[0] * ph + qb_bar_width),
-                            fill=1, outline=1)
-        plot_draw.rectangle((qb_width, self.values[1] * ph, 2 * qb_width, self.values[1] * ph + qb_bar_width),
-                            fill=1, outline=1)
-        plot_draw.rectangle((2 * qb_width, self.values[2] * ph, 3 * qb_width, self.values[2] * ph + qb_bar_width),
-                            fill=1, outline=1)
+        # Dark state img
+        self.dark_state_img = Image.new("1", (int(qb_width), 2 * qb_bar_width))
+        dark_state_draw = ImageDraw.Draw(self.dark_state_img)
+        dark_state_draw.rectangle((0, 0, qb_width, 2 * qb_bar_width), fill=0, outline=1)
+        dark_state_draw.text((10, 0), '|D>', fill=1)
+
+        # Bright state img
+        self.bright_state_img = Image.new("1", (int(qb_width), 2 * qb_bar_width))
+        bright_state_draw = ImageDraw.Draw(self.bright_state_img)
+        bright_state_draw.rectangle((0, 0, qb_width, 2 * qb_bar_width), fill=1, outline=0)
+        bright_state_draw.text((10, 0), '|B>', fill=0)
+
+    def hybridized_value(self):
+        """Value of the first two qubits if they are resonant, else None."""
+        if self.nb_pts > 1 and self.values[0] == self.values[1]:
+            return self.values[0]
+        return None
+
+    @metrics.timed("plot_render_seconds", plot="freq")
+    def update_graph_plot(self, columns=None):
+        if columns is None:
+            columns = range(self.nb_pts)
+        columns = set(columns)
+
+        # The hybridization overlay spans the first two columns
+        hybridization = self.hybridized_value()
+        if hybridization != self.shown_hybridization:
+            columns.update(range(min(2, self.nb_pts)))
+            self.shown_hybridization = hybridization
+
+        for first, last in self._column_runs(sorted(columns)):
+            self.mark_dirty(self._render_columns(first, last))
+
+    @staticmethod
+    def _column_runs(columns):
+        """Group sorted column indices into runs of consecutive columns."""
+        runs = []
+        for qb in columns:
+            if runs and runs[-1][1] >= qb - 1:
+                runs[-1][1] = qb
+            else:
+                runs.append([qb, qb])
+        return runs
+
+    def _render_columns(self, first, last):
+        """
+        Re-render the plot between the left divider of column ``first`` and
+        the right divider of column ``last``.
+        :return: changed box in main_img coordinates
+        """
+        ph = self.ph
+        qb_width = self.qb_width
+        x0 = int(first * qb_width)
+        x1 = min(int((last + 1) * qb_width), self.pw - 1)
+
+        # Draw in window coordinates, shifted by an integer so the result is
+        # the same as drawing the full plot
+        window = self.static_plot.crop((x0, 0, x1 + 1, ph))
+        window_draw = ImageDraw.Draw(window)
+
+        # Bars of neighbouring columns cover the shared divider line
+        for qb in range(max(first - 1, 0), min(last + 2, self.nb_pts)):
+            y = self.values[qb] * ph
+            window_draw.rectangle((qb * qb_width - x0, y, (qb + 1) * qb_width - x0, y + self.qb_bar_width),
+                                  fill=1, outline=1)
 
         # Show hybridization if necessary
-        if self.values[0] == self.values[1]:
-            # Dark state img
-            dark_state_img = Image.new("1", (int(qb_width), 2 * qb_bar_width))
-            dark_state_draw = ImageDraw.Draw(dark_state_img)
-            dark_state_draw.rectangle((0, 0, qb_width, 2 * qb_bar_width), fill=0, outline=1)
-            dark_state_draw.text((10, 0), '|D>', fill=1)
-            # dark_state_img = dark_state_img.resize((int(qb_width), int(1.5*qb_bar_width)), Image.ANTIALIAS)
+        if self.shown_hybridization is not None and first <= 1:
+            value = self.shown_hybridization
+            window.paste(self.dark_state_img, (int(qb_width / 2) - x0, int((value + self.hybridization) * ph)))
+            window.paste(self.bright_state_img, (int(qb_width / 2) - x0, int((value - self.hybridization) * ph)))
 
-            bright_state_img = Image.new("1", (int(qb_width), 2 * qb_bar_width))
-            bright_state_draw = ImageDraw.Draw(bright_state_img)
-            bright_state_draw.rectangle((0, 0, qb_width, 2 * qb_bar_width), fill=1, outline=0)
-            bright_state_draw.text((10, 0), '|B>', fill=0)
-            # bright_state_img = bright_state_img.resize((int(qb_width), int(1.5*qb_bar_width)), Image.ANTIALIAS)
+        self.plot_img.paste(window, (x0, 0))
+        self.main_img.paste(window, (self.buffer + x0, self.buffer))
+        return (self.buffer + x0, self.buffer, self.buffer + x1 + 1, self.buffer + ph)
 
-            plot_img.paste(dark_state_img, (int(qb_width / 2), int((self.values[0] + self.hybridization) * ph)))
-            plot_img.paste(bright_state_img, (int(qb_width / 2), int((self.values[0] - self.hybridization) * ph)))
 
-        self.main_img.paste(plot_img, (self.buffer, self.buffer))
+class NoisePlot(Plot):
+    """
+    Noise spectrum shaping plot, one bar per frequency bin.
 
+    The target spectrum is computed once. The distance to it is kept up to
+    date incrementally when a single bin changes, and the bars are rendered
+    straight into a boolean NumPy buffer (one bin's columns per update).
+    """
 
-class NoisePlot(Plot):
     def __init__(self, w, h, buffer, nb_pts):
         super().__init__(w, h, buffer, nb_pts)
 
-        self.values = [0.9] * (nb_pts)
-
+        self.values = np.full(nb_pts, 0.9)
 
         self.ypixels = 10
         self.xpixels = nb_pts
@@ -130,7 +220,13 @@ class NoisePlot(Plot):
         self.b = 5
         self.a = 2/10 * self.ypixels
 
-        self.current_distance = self.distance(self.noise_spec())
+        # The target never changes, neither do the bar geometry
+        self.target = self.noise_spec()
+        self.residuals = self.target - self.powers(self.values)
+        self.sq_norm = float(self.residuals @ self.residuals)
+        self.build_bar_geometry()
+
+        self.current_distance = self.distance()
         self.build_main_frame()
         self.update_graph_plot()
 
@@ -138,14 +234,35 @@ class NoisePlot(Plot):
         exp = (self.omega - self.omegac) ** 2 / (2 * np.pi * self.b) ** 2
         return self.a / (np.exp(exp) + 1)
 
-    def distance(self, target):
-        values = [(1 - v) - 0.1 for v in  self.values]
-        print(target, values, target - values)
-        norm = np.linalg.norm(target - values) / (0.5 * self.ypixels)
+    @staticmethod
+    def powers(values):
+        return (1 - values) - 0.1
+
+    def distance(self, target=None):
+        """
+        Normalised distance between the bars and the target spectrum.
+        :param target: optional spectrum to compare with. By default the
+        distance to self.target is returned from the running squared norm.
+        """
+        if target is None:
+            norm = np.sqrt(max(self.sq_norm, 0.0))
+        else:
+            norm = np.linalg.norm(target - self.powers(self.values))
+        norm /= 0.5 * self.ypixels
         if norm > 1:
             norm = 1
         return norm
 
+    def update_value(self, value_step, update=True):
+        marker = self.marker
+        self.values[marker] = round(self.values[marker] + value_step, 1)
+        # O(1) update of the squared norm for the changed bin
+        residual = self.target[marker] - self.powers(self.values[marker])
+        self.sq_norm += residual ** 2 - self.residuals[marker] ** 2
+        self.residuals[marker] = residual
+        if update:
+            self.update_graph_plot(columns=[marker])
+
     def build_main_frame(self):
         # Clear the img
         self.main_draw.rectangle((0, 0, self.w, self.h), fill=0, outline=0)
@@ -155,21 +272,47 @@ class NoisePlot(Plot):
         ylabel_img = self.build_ylabel(text='S(w) a.u.')
         self.main_img.paste(ylabel_img, (0, - int(0.5 * self.buffer)))
 
-    def update_graph_plot(self):
-        w = self.w - self.buffer
-        h = self.h - self.buffer
-
-        bar_width = w/self.nb_pts
-        power_plot = Image.new("1", (w, h))
-        power_draw = ImageDraw.Draw(power_plot)
-
-        for pidx, power in enumerate(self.values):
-            power_draw.rectangle(xy=(pidx*bar_width, power*h, (pidx+1)*bar_width,  power*h + 5), fill=1, outline=0)
-
-        self.main_img.paste(power_plot, (self.buffer, 0))
-
-        self.current_distance = self.distance(self.noise_spec())
-
+    def build_bar_geometry(self):
+        self.pw = self.w - self.buffer
+        self.ph = self.h - self.buffer
+        self.bar_width = self.pw / self.nb_pts
+        self.bar_height = 5
+        # Bars are drawn like a PIL rectangle with a black outline: on the
+        # columns strictly inside the bin edges. Bins narrower than that
+        # (e.g. one bin per OLED column) keep at least their first column.
+        edges = (np.arange(self.nb_pts + 1) * self.bar_width).astype(int)
+        self.bin_start = np.minimum(edges[:-1] + 1, self.pw)
+        self.bin_stop = np.minimum(edges[1:], self.pw)
+        narrow = self.bin_stop <= self.bin_start
+        self.bin_start[narrow] = np.minimum(edges[:-1][narrow], self.pw - 1)
+        self.bin_stop[narrow] = self.bin_start[narrow] + 1
+        # Bin drawn on each plot column, -1 for the gaps
+        self.column_bin = np.full(self.pw, -1)
+        for pidx in range(self.nb_pts):
+            self.column_bin[self.bin_start[pidx]:self.bin_stop[pidx]] = pidx
+        self.rows = np.arange(self.ph)[:, None]
+        self.plot_buf = np.zeros((self.ph, self.pw), dtype=bool)
+
+    def render_bars(self, x0, x1):
+        """Render the bars on plot columns x0..x1-1 into self.plot_buf."""
+        bins = self.column_bin[x0:x1]
+        top = (self.values * self.ph).astype(int)[bins]
+        bottom = (self.values * self.ph + self.bar_height).astype(int)[bins]
+        self.plot_buf[:, x0:x1] = (bins >= 0) & (self.rows > top) & (self.rows < bottom)
+
+    @metrics.timed("plot_render_seconds", plot="noise")
+    def update_graph_plot(self, columns=None):
+        if columns is None:
+            x0, x1 = 0, self.pw
+        else:
+            x0 = int(min(self.bin_start[c] for c in columns))
+            x1 = int(max(self.bin_stop[c] for c in columns))
+
+        self.render_bars(x0, x1)
+        self.main_img.paste(Image.fromarray(self.plot_buf[:, x0:x1]), (self.buffer + x0, 0))
+        self.mark_dirty((self.buffer + x0, 0, self.buffer + x1, self.ph))
+
+        self.current_distance = self.distance()
 
 
 # LED part
@@ -219,3 +362,38 @@ def value_to_rgb(value):
     frequency = min_freq + value * (max_freq - min_freq)
     return frequency_to_rgb(frequency)
 
+
+
+# Size of the precomputed colour table, values are quantised to 1/(size - 1)
+COLOR_LUT_SIZE = 1024
+
+
+def build_color_lut(size=COLOR_LUT_SIZE):
+    """
+    RGBW colours (white off) of ``size`` values evenly spaced in [0, 1].
+    :return: uint8 array of shape (size, 4)
+    """
+    lut = np.zeros((size, 4), dtype=np.uint8)
+    for idx, value in enumerate(np.linspace(0, 1, size)):
+        lut[idx, :3] = value_to_rgb(value)
+    return lut
+
+
+COLOR_LUT = build_color_lut()
+
+
+def values_to_rgbw(values, scale=1.0, lut=COLOR_LUT):
+    """
+    Vectorised value_to_rgb through the lookup table, with the white channel
+    and an optional brightness scaling.
+    :param values: values in [0, 1] (clipped), scalar or array
+    :param scale: brightness factor(s) in [0, 1], broadcast against values
+    :return: uint8 array of shape values.shape + (4,)
+    """
+    values = np.clip(np.asarray(values, dtype=float), 0, 1)
+    colors = lut[np.rint(values * (len(lut) - 1)).astype(np.intp)]
+    if np.ndim(scale) or scale != 1.0:
+        # Truncate like int(channel * scale)
+        scale = np.clip(np.asarray(scale, dtype=float), 0, 1)
+        colors = (colors * scale[..., None]).astype(np.uint8)
+    return colors
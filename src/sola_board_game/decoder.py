@@ -0,0 +1,229 @@
+"""
+Union-find decoder of the surface code samples.
+
+Decodes the X errors of a Z basis memory experiment (see
+sample_generator.py) from the Z stabilizer detection events of every round,
+plus a last layer of detection events computed from the data qubit readout.
+The decoding graph has one node per Z stabilizer and layer and a boundary
+node. Space-like edges are data qubit errors, time-like edges measurement
+errors. Clusters grow from the detection events until they are neutral
+(Delfosse & Nickerson), then the correction is found by peeling a spanning
+forest of the grown edges.
+
+    python decoder.py --benchmark    # decode time per round against distance
+    python decoder.py --check samples.sst    # decoding beats the raw log_op
+"""
+import argparse
+from collections import deque
+import time
+
+import numpy as np
+
+from sample_generator import NoiseModel, RotatedSurfaceCode, simulate
+from sample_store import SampleStore
+
+
+class UnionFindDecoder:
+    """
+    Decoder of one code distance and number of rounds.
+
+    ``logical_flip(syndromes, data_qubits)`` tells whether the measured
+    logical operator (sample['log_op']) must be flipped to recover the
+    prepared state (sample['log_op_init']).
+    """
+
+    def __init__(self, distance, n_rounds, code=None):
+        self.code = code or RotatedSurfaceCode(distance)
+        self.n_rounds = n_rounds
+        h_z = self.code.h_z
+        self.n_z = len(h_z)
+        n_layers = n_rounds + 1
+        self.n_nodes = n_layers * self.n_z + 1
+        self.boundary = self.n_nodes - 1
+
+        # edges[i] = (u, v, flips the logical operator)
+        edges = {}
+        for layer in range(n_layers):
+            base = layer * self.n_z
+            for qubit in range(self.code.n_data_qbs):
+                stabs = np.flatnonzero(h_z[:, qubit])
+                if len(stabs) == 2:
+                    key = (base + stabs[0], base + stabs[1])
+                else:
+                    key = (base + stabs[0], self.boundary)
+                # Parallel boundary edges are equivalent for distance >= 3
+                edges.setdefault(key, bool(self.code.z_logical[qubit]))
+            if layer < n_rounds:
+                for stab in range(self.n_z):
+                    edges[(base + stab, base + self.n_z + stab)] = False
+        self.edges = [(int(u), int(v), flip) for (u, v), flip in edges.items()]
+        self.incident = [[] for _ in range(self.n_nodes)]
+        for idx, (u, v, _) in enumerate(self.edges):
+            self.incident[u].append(idx)
+            self.incident[v].append(idx)
+
+    def detection_events(self, syndromes, data_qubits):
+        """
+        Z detection events of every layer.
+        :param syndromes: flat syndrome bits of a sample, Z stabilizers first
+        in each round
+        :return: bool array (n_rounds + 1, n_z)
+        """
+        n_aux = 2 * self.n_z
+        rounds = np.asarray(syndromes, dtype=np.uint8).reshape(-1, n_aux)[:, :self.n_z]
+        if len(rounds) != self.n_rounds:
+            raise ValueError(f"decoder built for {self.n_rounds} rounds, got {len(rounds)}")
+        # Last measured stabilizer values are the XOR of all detection events
+        last = np.bitwise_xor.reduce(rounds, axis=0)
+        final = (self.code.h_z @ np.asarray(data_qubits, dtype=np.uint8) % 2) ^ last
+        return np.vstack([rounds, final]).astype(bool)
+
+    def decode(self, defects):
+        """
+        :param defects: node indices of the detection events
+        :return: indices of the edges of the correction
+        """
+        parent = list(range(self.n_nodes))
+        members = {node: [node] for node in defects}
+        odd = {node: True for node in defects}
+        support = [0] * len(self.edges)
+
+        def find(node):
+            while parent[node] != node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+
+        def union(a, b):
+            a, b = find(a), find(b)
+            if a == b:
+                return
+            # The boundary stays a root, otherwise the larger cluster
+            if b == self.boundary or (a != self.boundary and len(members.get(a, ())) < len(members.get(b, ()))):
+                a, b = b, a
+            parent[b] = a
+            members.setdefault(a, [a]).extend(members.pop(b, [b]))
+            odd[a] = odd.pop(a, False) ^ odd.pop(b, False)
+
+        def active():
+            return [root for root, is_odd in odd.items()
+                    if is_odd and find(root) == root and root != self.boundary]
+
+        # Growth
+        roots = active()
+        while roots:
+            fused = []
+            for root in roots:
+                for node in members[root]:
+                    for idx in self.incident[node]:
+                        if support[idx] < 2:
+                            support[idx] += 1
+                            if support[idx] == 2:
+                                fused.append(idx)
+            for idx in fused:
+                u, v, _ = self.edges[idx]
+                union(u, v)
+            # A cluster touching the boundary is neutral
+            if self.boundary in odd:
+                odd[self.boundary] = False
+            roots = active()
+
+        # Peeling of a spanning forest of the grown edges, boundary first so
+        # that it is never a leaf
+        defect = [False] * self.n_nodes
+        for node in defects:
+            defect[node] = True
+        seen = [False] * self.n_nodes
+        tree = []
+        starts = [self.boundary] + list(defects)
+        for start in starts:
+            if seen[start]:
+                continue
+            seen[start] = True
+            queue = deque([start])
+            while queue:
+                node = queue.popleft()
+                for idx in self.incident[node]:
+                    if support[idx] < 2:
+                        continue
+                    u, v, _ = self.edges[idx]
+                    other = v if u == node else u
+                    if not seen[other]:
+                        seen[other] = True
+                        tree.append((idx, node, other))
+                        queue.append(other)
+
+        correction = []
+        for idx, up, leaf in reversed(tree):
+            if defect[leaf]:
+                correction.append(idx)
+                defect[leaf] = False
+                defect[up] = not defect[up]
+        return correction
+
+    def logical_flip(self, syndromes, data_qubits):
+        """True if the logical operator measured from data_qubits is flipped."""
+        defects = np.flatnonzero(self.detection_events(syndromes, data_qubits)).tolist()
+        flip = False
+        for idx in self.decode(defects):
+            flip ^= self.edges[idx][2]
+        return flip
+
+    def sample_flip(self, sample):
+        """logical_flip() of a sample dict, see sample_store.SampleStore."""
+        return self.logical_flip(sample["syndromes"], sample["data_qubits"])
+
+
+def benchmark(distances=(3, 5, 7), n_rounds=None, n_samples=2000, p=0.01, seed=0):
+    """
+    Decode time against distance, on generated samples.
+    :param n_rounds: rounds per sample, the distance by default
+    """
+    rng = np.random.default_rng(seed)
+    print(f"{'d':>3} {'rounds':>6} {'us/sample':>10} {'us/round':>9} {'logical error':>14}")
+    for d in distances:
+        rounds = n_rounds or d
+        decoder = UnionFindDecoder(d, rounds)
+        syndromes, data, log_op, init = simulate(decoder.code, NoiseModel(p, p, p), rounds, n_samples, rng)
+        start = time.perf_counter()
+        flips = [decoder.logical_flip(s, q) for s, q in zip(syndromes, data)]
+        elapsed = time.perf_counter() - start
+        errors = np.mean((log_op ^ np.array(flips, dtype=np.uint8)) != init)
+        print(f"{d:>3} {rounds:>6} {1e6 * elapsed / n_samples:>10.1f} "
+              f"{1e6 * elapsed / n_samples / rounds:>9.1f} {errors:>14.4f}")
+
+
+def check_store(path):
+    """
+    Decode a sample store and compare with the raw measured logical
+    operator. A decoder built for another stabilizer layout than the samples
+    does no better than the raw value.
+    :return: (raw agreement, decoded agreement) with log_op_init
+    """
+    store = SampleStore(path)
+    distance = int(round(store.n_data_qbs ** 0.5))
+    decoder = UnionFindDecoder(distance, len(store.rounds(0)))
+    raw = decoded = 0
+    for i in range(len(store)):
+        sample = store[i]
+        raw += sample["log_op"] == sample["log_op_init"]
+        decoded += (sample["log_op"] ^ decoder.sample_flip(sample)) == sample["log_op_init"]
+    return raw / len(store), decoded / len(store)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Surface code decoder")
+    parser.add_argument("--benchmark", action="store_true", help="decode time against distance")
+    parser.add_argument("--distances", type=int, nargs="+", default=[3, 5, 7])
+    parser.add_argument("--rounds", type=int, help="rounds per sample, the distance by default")
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("-p", type=float, default=0.01, help="error probabilities")
+    parser.add_argument("--check", metavar="STORE", help="check the decoding of a sample store")
+    args = parser.parse_args()
+    if args.check:
+        raw, decoded = check_store(args.check)
+        print(f"{args.check}: log_op_init agreement raw {raw:.3f}, decoded {decoded:.3f}")
+        if decoded <= raw:
+            raise SystemExit("Decoding does not beat the raw logical operator, wrong stabilizer layout?")
+    if args.benchmark:
+        benchmark(args.distances, args.rounds, args.samples, args.p)
@@ -0,0 +1,68 @@
+import threading
+import time
+
+
+class DeviceRegistry:
+    """
+    Creates devices on first use and logs how long each one took.
+
+    Devices are registered with a factory and built by ``get()``, or ahead of
+    time in a background thread by ``warm_up()``, so that slow peripherals do
+    not delay the first screen. A device is built only once, whichever thread
+    asks for it first, the threads asking for it meanwhile wait for it. Each
+    device has its own lock, so a slow device built in the background does not
+    hold up the others.
+    """
+
+    def __init__(self, log=print):
+        self.factories = {}
+        self.devices = {}
+        # Seconds spent building each device
+        self.timings = {}
+        self.log = log
+        # name: lock held while the device is built, so that it is built once
+        # and never seen half built. Reentrant for factories getting devices.
+        self.locks = {}
+        self._warm_thread = None
+
+    def register(self, name, factory):
+        """
+        :param factory: callable without arguments returning the device
+        """
+        self.factories[name] = factory
+        self.locks[name] = threading.RLock()
+
+    def ready(self, name):
+        return name in self.devices
+
+    def get(self, name):
+        device = self.devices.get(name)
+        if device is not None:
+            return device
+        with self.locks[name]:
+            if name not in self.devices:
+                start = time.perf_counter()
+                self.devices[name] = self.factories[name]()
+                self.timings[name] = time.perf_counter() - start
+                if self.log is not None:
+                    self.log(f"{name} ready in {1e3 * self.timings[name]:.0f} ms")
+            return self.devices[name]
+
+    def warm_up(self, names=None):
+        """
+        Build devices in a background thread.
+        :param names: devices to build in this order, all registered by default
+        """
+        names = list(self.factories) if names is None else list(names)
+
+        def run():
+            for name in names:
+                self.get(name)
+
+        self._warm_thread = threading.Thread(target=run, name="devices", daemon=True)
+        self._warm_thread.start()
+
+    def join(self):
+        """Wait for the background warm up to finish."""
+        if self._warm_thread is not None:
+            self._warm_thread.join()
@@ -0,0 +1,232 @@
+from contextlib import contextmanager
+import time
+
+from PIL import ImageDraw, Image
+
+import metrics
+
+# SSD1306 commands used for windowed (partial) updates
+SET_COL_ADDR = 0x21
+SET_PAGE_ADDR = 0x22
+# I2C control byte announcing a stream of display data (Co=0, D/C=1)
+I2C_DATA_CONTROL = 0x40
+# Each SSD1306 page is a horizontal band of 8 pixel rows, one byte per column
+PAGE_HEIGHT = 8
+# Byte with its bits in reverse order: PIL packs the pixels of a row MSB
+# first, a page byte has its top pixel in the LSB
+_REVERSED_BITS = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+
+def pack_image(image):
+    """
+    Convert a mode "1" image to SSD1306 page order (page * width + column,
+    row y in bit y % 8), like the driver's image() but without a Python loop
+    over the pixels.
+
+    Transposed, each column of the image is a row that PIL packs into bytes
+    of 8 pixels, i.e. into the page bytes of that column with their bits
+    reversed. Only the bit order and the column-major byte order are left to
+    change, both in C.
+    :return: bytes of length pages * width
+    """
+    width, height = image.size
+    pages = height // PAGE_HEIGHT
+    columns = image.transpose(Image.TRANSPOSE).tobytes().translate(_REVERSED_BITS)
+    return b"".join(columns[page::pages] for page in range(pages))
+
+
+def unpack_image(packed, width, height):
+    """Inverse of pack_image(), :return: mode "1" image"""
+    pages = height // PAGE_HEIGHT
+    columns = bytearray(len(packed))
+    for page in range(pages):
+        columns[page::pages] = packed[page * width:(page + 1) * width]
+    image = Image.frombytes("1", (height, width), bytes(columns.translate(_REVERSED_BITS)))
+    return image.transpose(Image.TRANSPOSE)
+
+
+class FrameBuffer:
+    """
+    Persistent 1-bit canvas in front of an SSD1306 display.
+
+    Drawing happens on ``self.image`` / ``self.draw``. Nothing is sent to the
+    display until ``flush()`` is called, which compares the canvas against
+    what the panel currently shows and only transfers the pages/columns that
+    changed. Several draw calls can therefore be batched into one transfer.
+    """
+
+    def __init__(self, disp):
+        self.disp = disp
+        self.width = disp.width
+        self.height = disp.height
+        self.pages = self.height // PAGE_HEIGHT
+
+        self._image = Image.new("1", (self.width, self.height), color=0)
+        self._draw = ImageDraw.Draw(self._image)
+        # Frame in page order set by load_packed(). The canvas is only updated
+        # from it when it is drawn on.
+        self._loaded = None
+
+        # Copy of the panel RAM in SSD1306 page order (page * width + column).
+        # The driver clears the panel on init, so we start from all black.
+        self._shown = bytearray(self.pages * self.width)
+        # Narrow displays use centered columns (same as the adafruit driver)
+        self._col_offset = (128 - self.width) // 2 if self.width != 128 else 0
+        self._batch_depth = 0
+
+        # Statistics, handy to see how much the bus is actually used
+        self.flushes = 0
+        self.bytes_sent = 0
+
+    @property
+    def image(self):
+        if self._loaded is not None:
+            self._sync_canvas()
+        return self._image
+
+    @property
+    def draw(self):
+        if self._loaded is not None:
+            self._sync_canvas()
+        return self._draw
+
+    def clear(self):
+        """Blank the canvas (does not flush)."""
+        self._loaded = None
+        self._draw.rectangle((0, 0, self.width, self.height), fill=0, outline=0)
+
+    def load_packed(self, packed):
+        """
+        Replace the canvas with a frame in SSD1306 page order, e.g. from
+        packed(), without drawing it (does not flush).
+        """
+        if len(packed) != self.pages * self.width:
+            raise ValueError(f"Expected {self.pages * self.width} bytes, got {len(packed)}")
+        self._loaded = packed
+
+    def packed(self):
+        """:return: the canvas in SSD1306 page order, as bytes"""
+        return bytes(self._pack())
+
+    def _sync_canvas(self):
+        # Only when drawing over a loaded frame
+        self._image.paste(unpack_image(self._loaded, self.width, self.height))
+        self._loaded = None
+
+    def paste(self, img, position=(0, 0)):
+        """Copy a mode "1" image onto the canvas (does not flush)."""
+        self.image.paste(img, position)
+
+    def show_image(self, img, box=None):
+        """
+        Copy ``img`` onto the canvas and flush the differences.
+        :param box: optional (x0, y0, x1, y1) region of ``img`` known to have
+        changed (x1/y1 exclusive), only this region is copied and compared.
+        """
+        if box is None:
+            self.paste(img)
+        else:
+            self.paste(img.crop(box), box[:2])
+        self.flush(box=box)
+
+    @contextmanager
+    def batch(self):
+        """Defer all flushes inside the block to a single flush at its end."""
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+        self.flush()
+
+    def _pack(self):
+        """
+        Convert the canvas to SSD1306 page order, the driver's buffer and
+        image() are bypassed: flush() writes the pages to the bus itself.
+        :return: buffer of length pages * width
+        """
+        if self._loaded is not None:
+            return memoryview(self._loaded)
+        return memoryview(pack_image(self._image))
+
+    def dirty_windows(self, packed, box=None):
+        """
+        Compare ``packed`` with the panel content.
+        :param packed: canvas in SSD1306 page order
+        :param box: optional (x0, y0, x1, y1) region to compare, x1/y1
+        exclusive. The rest of the canvas is assumed unchanged.
+        :return: list of (col0, col1, page0, page1) windows, bounds inclusive.
+        Consecutive dirty pages are merged into one window spanning the union
+        of their changed columns.
+        """
+        if box is None:
+            x0, x1, page0, page1 = 0, self.width, 0, self.pages
+        else:
+            x0 = max(box[0], 0)
+            x1 = min(box[2], self.width)
+            page0 = max(box[1], 0) // PAGE_HEIGHT
+            page1 = min((box[3] + PAGE_HEIGHT - 1) // PAGE_HEIGHT, self.pages)
+
+        windows = []
+        for page in range(page0, page1):
+            start = page * self.width
+            new = packed[start + x0:start + x1]
+            old = self._shown[start + x0:start + x1]
+            if new == old:
+                continue
+            col0 = 0
+            while new[col0] == old[col0]:
+                col0 += 1
+            col1 = x1 - x0 - 1
+            while new[col1] == old[col1]:
+                col1 -= 1
+            col0 += x0
+            col1 += x0
+            if windows and windows[-1][3] == page - 1:
+                prev = windows[-1]
+                windows[-1] = (min(prev[0], col0), max(prev[1], col1), prev[2], page)
+            else:
+                windows.append((col0, col1, page, page))
+        return windows
+
+    def flush(self, force=False, box=None):
+        """
+        Send the changed part of the canvas to the display.
+        :param force: resend the full frame even if nothing changed
+        :param box: optional region to compare, see dirty_windows()
+        :return: number of data bytes transferred
+        """
+        if self._batch_depth and not force:
+            return 0
+        flush_start = time.perf_counter()
+        packed = self._pack()
+        if force:
+            windows = [(0, self.width - 1, 0, self.pages - 1)]
+        else:
+            windows = self.dirty_windows(packed, box=box)
+
+        sent = 0
+        for col0, col1, page0, page1 in windows:
+            data = bytearray([I2C_DATA_CONTROL])
+            for page in range(page0, page1 + 1):
+                start = page * self.width
+                row = packed[start + col0:start + col1 + 1]
+                data += row
+                # Only what was sent is known to be on the panel
+                self._shown[start + col0:start + col1 + 1] = row
+            self._write_window(col0, col1, page0, page1, data)
+            sent += len(data) - 1
+
+        self.flushes += 1
+        self.bytes_sent += sent
+        metrics.observe("display_flush_seconds", time.perf_counter() - flush_start)
+        metrics.observe("display_flush_bytes", sent)
+        return sent
+
+    def _write_window(self, col0, col1, page0, page1, data):
+        disp = self.disp
+        for cmd in (SET_COL_ADDR, col0 + self._col_offset, col1 + self._col_offset,
+                    SET_PAGE_ADDR, page0, page1):
+            disp.write_cmd(cmd)
+        with disp.i2c_device:
+            disp.i2c_device.write(data)
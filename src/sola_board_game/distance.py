@@ -0,0 +1,107 @@
+from collections import deque
+import statistics
+import threading
+import time
+
+# The HC-SR04 needs about 60 ms between two measurements, otherwise the echo
+# of the previous ping can be taken for the new one
+SAMPLE_PERIOD = 0.06
+
+
+class DistanceMonitor:
+    """
+    Samples a distance sensor in a background thread and filters it.
+
+    The raw readings go to a ring buffer of the last ``window`` samples. The
+    filtered distance is the exponential moving average (``alpha``) of their
+    median, so a single bad echo is rejected and the shown value does not
+    flicker. ``level`` tells whether the filtered distance is in
+    [min_cm, max_cm], with ``hysteresis_cm`` of margin before it leaves the
+    window again.
+    """
+
+    def __init__(self, sensor, min_cm, max_cm, hysteresis_cm=0.5, window=3, alpha=0.5,
+                 sample_period=SAMPLE_PERIOD, telemetry=None, clock=time):
+        self.sensor = sensor
+        # Time of the level changes, e.g. the game clock of the backend
+        self.clock = clock
+        # Raw readings are recorded there, if given
+        self.telemetry = telemetry
+        self.min_cm = min_cm
+        self.max_cm = max_cm
+        self.hysteresis_cm = hysteresis_cm
+        self.alpha = alpha
+        self.sample_period = sample_period
+
+        self.raw = deque(maxlen=window)
+        # Filtered distance in cm, None until the first sample
+        self.distance_cm = None
+        self.level = False
+        # clock.monotonic() of the last level change
+        self.level_since = None
+        self.samples = 0
+
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """Start sampling from an empty buffer."""
+        if self._running:
+            return
+        with self._lock:
+            self.raw.clear()
+            self.distance_cm = None
+            self.level = False
+            self.level_since = None
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="distance", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def state(self):
+        """
+        :return: (filtered distance in cm or None, level, time of the last
+        level change)
+        """
+        with self._lock:
+            return self.distance_cm, self.level, self.level_since
+
+    def add_sample(self, distance_m, now):
+        """Filter one raw reading, in meters."""
+        with self._lock:
+            self.raw.append(100 * distance_m)
+            median = statistics.median(self.raw)
+            if self.distance_cm is None:
+                self.distance_cm = median
+            else:
+                self.distance_cm += self.alpha * (median - self.distance_cm)
+
+            if self.level:
+                margin = self.hysteresis_cm
+                level = self.min_cm - margin <= self.distance_cm <= self.max_cm + margin
+            else:
+                level = self.min_cm <= self.distance_cm <= self.max_cm
+            if level != self.level:
+                self.level = level
+                self.level_since = now
+            self.samples += 1
+
+    def _run(self):
+        next_sample = time.monotonic()
+        while self._running:
+            distance_m = self.sensor.distance
+            if self.telemetry is not None:
+                self.telemetry.record("distance", distance_m)
+            self.add_sample(distance_m, self.clock.monotonic())
+            next_sample += self.sample_period
+            delay = next_sample - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_sample = time.monotonic()
@@ -0,0 +1,193 @@
+import asyncio
+import json
+import os
+import time
+
+import metrics
+from telemetry import STAGE_START, STAGE_END
+
+# Transition that ends the game
+END = "end"
+
+
+class Checkpoint:
+    """
+    Progress of the game in a small JSON file, so that a restarted service
+    resumes at the stage after the last completed one.
+    :param path: checkpoint file, None disables checkpointing
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """:return: saved dict ('completed', 'next', 'time'), None if there is none"""
+        if self.path is None or not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable checkpoint {self.path}: {e}")
+            return None
+
+    def save(self, completed, next_state):
+        if self.path is None:
+            return
+        tmp = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(tmp, "w") as f:
+                json.dump({"completed": completed, "next": next_state, "time": time.time()}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            # Atomic, a power cut never leaves a half written checkpoint
+            os.replace(tmp, self.path)
+        except OSError as e:
+            # e.g. a read-only or full disk, the game goes on without it
+            print(f"Cannot save the progress to {self.path}: {e}")
+
+    def clear(self):
+        if self.path is not None and os.path.exists(self.path):
+            try:
+                os.remove(self.path)
+            except OSError as e:
+                print(f"Cannot clear the progress in {self.path}: {e}")
+
+
+class StageRunner:
+    """
+    Runs the hat stages as coroutines on one asyncio event loop.
+
+    The game is a state machine declared as data: each state names a stage
+    coroutine of the hat, its arguments and the state that follows it (the
+    next one in the list by default, END ends the game). States can be
+    skipped, and the order changed, in the game file without code edits, see
+    load_game(). The progress is checkpointed after every stage.
+
+    Input events from the sampling thread are forwarded to the loop, so a
+    stage awaits a connection or a pause without blocking the input sampling
+    or the LED and display updates.
+    """
+
+    def __init__(self, hat, checkpoint=None):
+        """
+        :param checkpoint: path of the checkpoint file, None to always start
+        from the first state
+        """
+        self.hat = hat
+        self.checkpoint = Checkpoint(checkpoint)
+        # name: dict(stage=coroutine function, args, next, skip), in order
+        self.states = {}
+
+    def add_stage(self, stage, *args, name=None, next_state=None, skip=False):
+        """
+        :param name: state name, the stage name (and arguments) by default
+        :param next_state: state that follows, the next added one by default
+        """
+        if name is None:
+            name = stage.__name__ + (f"{args}" if args else "")
+        if name in self.states or name == END:
+            raise ValueError(f"Duplicate state {name}")
+        self.states[name] = dict(stage=stage, args=args, next=next_state, skip=skip)
+
+    def load_game(self, path, skip=()):
+        """
+        Add the states of a game file, JSON like
+            {"states": [{"name": "welcome", "stage": "initial_stage"},
+                        {"name": "leg_3di", "stage": "sola_stage", "args": [1],
+                         "next": "finish", "skip": false}, ...]}
+        "stage" is a method of the hat, "args", "next" and "skip" are optional.
+        :param skip: names of more states to skip
+        """
+        with open(path) as f:
+            game = json.load(f)
+        for state in game["states"]:
+            stage = getattr(self.hat, state["stage"], None)
+            if stage is None:
+                raise ValueError(f"{path}: unknown stage {state['stage']}")
+            self.add_stage(stage, *state.get("args", ()), name=state["name"],
+                           next_state=state.get("next"), skip=state.get("skip", False))
+        for name in skip:
+            if name not in self.states:
+                raise ValueError(f"Cannot skip unknown state {name}")
+            self.states[name]["skip"] = True
+        self.transitions()
+
+    def transitions(self):
+        """:return: {state: next state or None}, checked against the states"""
+        names = list(self.states)
+        transitions = {}
+        for i, name in enumerate(names):
+            next_state = self.states[name]["next"]
+            if next_state is None:
+                next_state = names[i + 1] if i + 1 < len(names) else None
+            elif next_state == END:
+                next_state = None
+            elif next_state not in self.states:
+                raise ValueError(f"State {name} goes to unknown state {next_state}")
+            transitions[name] = next_state
+        return transitions
+
+    def resume_state(self):
+        """:return: state to start at, after the checkpointed progress"""
+        if not self.states:
+            return None
+        first = next(iter(self.states))
+        saved = self.checkpoint.load()
+        if saved is None:
+            return first
+        if saved.get("next") not in self.states:
+            print(f"Checkpoint state {saved.get('next')} is not in the game, starting over")
+            return first
+        print(f"Resuming after {saved['completed']} at {saved['next']}")
+        return saved["next"]
+
+    async def run_stage(self, stage, *args, name=None):
+        if name is None:
+            name = f"{stage.__name__}{args}"
+        # Events and bypasses of the previous stage do not leak into this one,
+        # the stage listens to the inputs it waits for
+        self.hat.reset_events()
+        self.hat.listen()
+        self.hat.state = name
+        self.hat.telemetry.text(STAGE_START, name)
+        start = time.monotonic()
+        try:
+            result = await stage(*args)
+        finally:
+            self.hat.telemetry.text(STAGE_END, name)
+            metrics.observe("stage_seconds", time.monotonic() - start, stage=stage.__name__)
+        print(f'{name} done in {time.monotonic() - start:.1f} s')
+        return result
+
+    async def run(self, start=None):
+        """
+        :param start: state to start at, by default the one after the
+        checkpointed progress
+        """
+        transitions = self.transitions()
+        name = self.resume_state() if start is None else start
+        if name is not None and name not in self.states:
+            raise ValueError(f"Unknown state {name}")
+
+        self.hat.attach_loop(asyncio.get_running_loop())
+        try:
+            # Guards against a loop of skipped states
+            skipped = 0
+            while name is not None:
+                state = self.states[name]
+                if state["skip"]:
+                    skipped += 1
+                    if skipped > len(self.states):
+                        raise RuntimeError(f"Only skipped states in the loop through {name}")
+                else:
+                    skipped = 0
+                    await self.run_stage(state["stage"], *state["args"], name=name)
+                    self.checkpoint.save(name, transitions[name])
+                name = transitions[name]
+            # Game over, the next start is a new game
+            self.hat.state = "done"
+            self.checkpoint.clear()
+        finally:
+            self.hat.detach_loop()
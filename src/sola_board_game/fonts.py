@@ -0,0 +1,233 @@
+from collections import OrderedDict
+import math
+
+from PIL import ImageDraw, Image, ImageFont
+
+# Printable ASCII, covers every string the hat shows
+ASCII_CHARS = "".join(chr(c) for c in range(32, 127))
+# Font sizes used by the hat screens, their atlas is built up front
+ATLAS_SIZES = (11, 15)
+# Same default line spacing as PIL's multiline text
+LINE_SPACING = 4
+# Changed when the atlas draws text differently, part of the screen cache
+# signature
+ATLAS_VERSION = 2
+
+
+class GlyphAtlas:
+    """
+    Pre-rasterised 1-bit glyphs of one font size.
+
+    Text is laid out like PIL's ``ImageDraw.text``: the glyphs at their
+    kerned pen positions, rounded like FreeType does, each line placed from
+    its length and bounding box (anchors, left aligned multiline text). These
+    are computed from the metrics of the atlas, the same as
+    ``font.getlength(line)`` and ``font.getbbox(line)``. The glyphs are then
+    blitted from the atlas, so drawing does not go through FreeType anymore
+    and gives the same pixels as ``ImageDraw.text``, see the atlas scenario of
+    benchmark.py. Lines of only "_" and spaces are
+    the exception, PIL clips their glyphs.
+    """
+
+    def __init__(self, font, chars=ASCII_CHARS):
+        self.font = font
+        self.chars = frozenset(chars)
+        # char -> (glyph image or None for blank glyphs, (dx, dy) from pen
+        # position on the baseline, advance)
+        self.glyphs = {}
+        for ch in chars:
+            left, top, right, bottom = font.getbbox(ch, mode="1", anchor="ls")
+            glyph = None
+            if right > left and bottom > top:
+                glyph = Image.new("1", (right - left, bottom - top), color=0)
+                ImageDraw.Draw(glyph).text((-left, -top), ch, font=font, anchor="ls", fill=1)
+            self.glyphs[ch] = (glyph, (left, top), font.getlength(ch, mode="1"))
+        # Sets the top of any line it is in
+        self.tallest = min(chars, key=lambda ch: self.glyphs[ch][1][1])
+        # char: (dx, dy) after other glyphs, filled as glyphs are drawn
+        self.inline = {}
+        # (char, char): kerning, filled as pairs are drawn
+        self.kerning = {}
+        self.line_spacing = font.getbbox("A", mode="1")[3] + LINE_SPACING
+        # Vertical anchor: offset of the line w.r.t. its baseline, the same
+        # for every line (ascender, descender)
+        base_top = font.getbbox("A", mode="1", anchor="ls")[1]
+        self.anchor_dy = {v: font.getbbox("A", mode="1", anchor="l" + v)[1] - base_top for v in "asdm"}
+
+    def inline_offset(self, ch):
+        """
+        (dx, dy) of a glyph that does not set the left edge of its line, and
+        not its top edge either.
+        """
+        offset = self.inline.get(ch)
+        if offset is None:
+            offset = self.inline[ch] = (self._inline_offset(" ", ch)[0],
+                                        self._inline_offset(self.tallest + "  ", ch)[1])
+        return offset
+
+    def _inline_offset(self, before, ch):
+        """
+        (dx, dy) of a glyph drawn after the text ``before``, measured on the
+        text rendered by FreeType. Some glyphs (e.g. "v", "~") are one pixel
+        off their bounding box when they do not set the left or top edge of
+        the line.
+        """
+        size = self.font.size
+        text = before + ch
+        image = Image.new("1", ((len(text) + 2) * size, 3 * size), color=0)
+        ImageDraw.Draw(image).text((size, 2 * size), text, font=self.font, anchor="ls", fill=1)
+        pen = self.font.getlength(text, mode="1") - self.font.getlength(ch, mode="1")
+        x = size + ((int(pen * 64) + 32) >> 6)
+        # The glyph only, not the text before it
+        ink = image.crop((x - size // 2, 0, image.width, image.height)).getbbox()
+        glyph_ink = self.glyphs[ch][0].getbbox()
+        if ink is None or glyph_ink is None:
+            return self.font.getbbox(ch, mode="1", anchor="ls")[:2]
+        return ink[0] - size // 2 - glyph_ink[0], ink[1] - 2 * size - glyph_ink[1]
+
+    def covers(self, text, anchor):
+        return anchor[1] in "asdm" and self.chars.issuperset(text.replace("\n", ""))
+
+    def line_width(self, line, positions=None):
+        """font.getlength(line), from the advances and kerning of the glyphs."""
+        if not line:
+            return 0.0
+        if positions is None:
+            positions = self.pen_positions(line)
+        return positions[-1] + self.glyphs[line[-1]][2]
+
+    def pen_positions(self, line):
+        """Kerned pen position of each glyph, as in font.getlength()."""
+        positions = []
+        pen = 0.0
+        previous = None
+        for ch in line:
+            if previous is not None:
+                pair = (previous, ch)
+                kerning = self.kerning.get(pair)
+                if kerning is None:
+                    kerning = self.kerning[pair] = (self.font.getlength(previous + ch, mode="1")
+                                                    - self.glyphs[previous][2] - self.glyphs[ch][2])
+                pen += self.glyphs[previous][2] + kerning
+            positions.append(pen)
+            previous = ch
+        return positions
+
+    def draw_text(self, draw, position, text, anchor="la", fill=1):
+        x, y = position
+        lines = text.split("\n")
+        if len(lines) == 1:
+            placed = [(x, y, text)]
+        else:
+            # Multiline text is left aligned within the block: each line is
+            # anchored like the block, moved by its width difference
+            widths = [self.line_width(line) for line in lines]
+            max_width = max(widths)
+            if anchor[1] == "m":
+                y -= (len(lines) - 1) * self.line_spacing / 2.0
+            elif anchor[1] == "d":
+                y -= (len(lines) - 1) * self.line_spacing
+            placed = []
+            for line, width in zip(lines, widths):
+                shift = {"l": 0, "m": (max_width - width) / 2.0, "r": max_width - width}[anchor[0]]
+                placed.append((x - shift, y, line))
+                y += self.line_spacing
+        for line_x, line_y, line in placed:
+            if line:
+                self._draw_line(draw, line_x, line_y, line, anchor, fill)
+
+    def _draw_line(self, draw, x, y, line, anchor, fill):
+        positions = self.pen_positions(line)
+        # Anchor offsets of the line w.r.t. its left baseline point, rounded
+        # from the 26.6 length like FreeType. The top of the line bounding box
+        # is the one of its tallest glyph, the baseline at least.
+        width = int(self.line_width(line, positions) * 64)
+        anchor_x = {"l": 0, "m": -((width // 2 + 32) >> 6), "r": -((width + 32) >> 6)}[anchor[0]]
+        anchor_y = self.anchor_dy[anchor[1]]
+        line_top = min(self.glyphs[ch][1][1] for ch in line)
+        # Like PIL: whole pixels of the position, then the fraction added to
+        # the pen positions in FreeType's 26.6 fixed point and rounded. y
+        # points up in FreeType, its halves round down on the image.
+        x_start = math.floor(math.modf(x)[0] * 64 + 0.5)
+        y_start = math.floor(math.modf(y)[0] * 64 + 0.5)
+        pen_x = int(x) + anchor_x
+        baseline = int(y) + anchor_y - ((32 - y_start) >> 6)
+        mask_top = int(y) + anchor_y + min(0, line_top)
+        # The first glyph is at its bounding box and moves the others by its
+        # offset, the tallest glyphs are at their bounding box
+        shift = 0
+        if self.glyphs[line[0]][0] is not None:
+            shift = self.glyphs[line[0]][1][0] - self.inline_offset(line[0])[0]
+        for i, (ch, pen) in enumerate(zip(line, positions)):
+            glyph, (dx, dy), _ = self.glyphs[ch]
+            if glyph is None:
+                continue
+            if i > 0:
+                dx = self.inline_offset(ch)[0] + shift
+            if dy > line_top:
+                dy = self.inline_offset(ch)[1]
+            # PIL renders the line in a mask starting at int(y), a line rounded
+            # up out of it loses its top row
+            if baseline + dy < mask_top:
+                glyph = glyph.crop((0, mask_top - baseline - dy, glyph.width, glyph.height))
+                dy = mask_top - baseline
+            draw.bitmap((pen_x + ((x_start + int(pen * 64) + 32) >> 6) + dx, baseline + dy), glyph, fill=fill)
+
+
+class FontCache:
+    """
+    LRU cache of TrueType fonts keyed by size, with glyph atlases for the
+    sizes used on the hat.
+
+    ``hits``/``misses`` count font lookups, ``atlas_hits``/``atlas_misses``
+    count ``draw_text`` calls served from an atlas or by FreeType.
+    """
+
+    def __init__(self, path, maxsize=4, atlas_sizes=ATLAS_SIZES):
+        self.path = path
+        self.maxsize = maxsize
+        self._fonts = OrderedDict()
+        self._atlases = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.atlas_hits = 0
+        self.atlas_misses = 0
+
+        for size in atlas_sizes:
+            self._atlases[size] = GlyphAtlas(self.get(size))
+
+    def get(self, size):
+        """Return the font of the given size, loading it on a miss."""
+        font = self._fonts.get(size)
+        if font is not None:
+            self.hits += 1
+            self._fonts.move_to_end(size)
+            return font
+        self.misses += 1
+        font = ImageFont.truetype(self.path, size)
+        self._fonts[size] = font
+        if len(self._fonts) > self.maxsize:
+            self._fonts.popitem(last=False)
+        return font
+
+    def draw_text(self, draw, position, text, size, anchor="la", fill=1):
+        """
+        Draw text using the glyph atlas of ``size`` when it covers the text,
+        and PIL/FreeType otherwise.
+        """
+        atlas = self._atlases.get(size)
+        if atlas is not None and atlas.covers(text, anchor):
+            self.atlas_hits += 1
+            atlas.draw_text(draw, position, text, anchor=anchor, fill=fill)
+        else:
+            self.atlas_misses += 1
+            draw.text(position, text, font=self.get(size), anchor=anchor, fill=fill)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "atlas_hits": self.atlas_hits,
+            "atlas_misses": self.atlas_misses,
+        }
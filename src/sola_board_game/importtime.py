@@ -0,0 +1,82 @@
+"""
+In-process import time profiler, like ``python -X importtime`` but usable in
+the running game: imports done later by the stages are recorded too.
+"""
+import builtins
+import json
+import sys
+import threading
+import time
+
+
+class ImportTimer:
+    """
+    Records the first import of every module while installed.
+
+    ``records`` holds one dict per module: name, 'at' (s since install()),
+    'cumulative' (s, including the modules it imported) and 'self' (s,
+    excluding them).
+    """
+
+    def __init__(self):
+        self.records = []
+        self.start = None
+        self._original = None
+        self._local = threading.local()
+
+    def install(self):
+        self.start = time.perf_counter()
+        self._original = builtins.__import__
+        builtins.__import__ = self._import
+        return self
+
+    def uninstall(self):
+        if self._original is not None:
+            builtins.__import__ = self._original
+            self._original = None
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc):
+        self.uninstall()
+        return False
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        # Already imported (the common case) or relative: no bookkeeping
+        if level or name in sys.modules:
+            return self._original(name, globals, locals, fromlist, level)
+
+        # Time spent in nested imports, per thread
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self._original(name, globals, locals, fromlist, level)
+        finally:
+            cumulative = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += cumulative
+            self.records.append({
+                "name": name,
+                "at": start - self.start,
+                "cumulative": cumulative,
+                "self": cumulative - children,
+            })
+
+    def report(self, top=15, since=0.0):
+        """
+        Slowest imports, by cumulative time.
+        :param since: only imports started that many s after install()
+        """
+        records = sorted((r for r in self.records if r["at"] >= since),
+                         key=lambda r: r["cumulative"], reverse=True)
+        lines = [f"{'module':30s} {'cumulative ms':>13s} {'self ms':>8s} {'at s':>6s}"]
+        for r in records[:top]:
+            lines.append(f"{r['name']:30s} {1e3 * r['cumulative']:>13.1f} {1e3 * r['self']:>8.1f} {r['at']:>6.2f}")
+        return "\n".join(lines)
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.records, f, indent=1)
@@ -0,0 +1,209 @@
+from collections import namedtuple
+import queue
+import threading
+import time
+
+import metrics
+
+PRESS = "press"
+RELEASE = "release"
+HOLD = "hold"
+
+# name: pin name, kind: PRESS, RELEASE or HOLD, time: clock.monotonic() stamp
+InputEvent = namedtuple("InputEvent", ["name", "kind", "time"])
+
+
+class Pin:
+    """Debounce state of one digital input."""
+
+    def __init__(self, name, io, active_low=True, repeat=False, debounce=0.03):
+        self.name = name
+        self.io = io
+        # s the input must be stable before its state changes
+        self.debounce = debounce
+        # Buttons and most SOLA legs pull the pin low when active
+        self.active_low = active_low
+        # Emit HOLD events while the input stays active
+        self.repeat = repeat
+
+        self.raw = False
+        self.active = False
+        self.last_change = 0.0
+        # No HOLD for an input already active when it is registered
+        self.next_repeat = float("inf")
+
+    def read(self):
+        return self.io.value != self.active_low
+
+
+class InputService:
+    """
+    Samples the digital inputs in one background thread and turns them into
+    debounced PRESS/RELEASE/HOLD events.
+
+    An input must be stable for ``debounce`` seconds before its state changes,
+    so one physical press gives exactly one PRESS. Inputs registered with
+    ``repeat=True`` send a HOLD event after ``hold_delay`` seconds, then every
+    ``hold_repeat`` seconds while held. Stages block on ``get()`` instead of
+    polling the pins themselves.
+
+    Only the inputs passed to ``listen()`` are sampled, every
+    ``idle_period`` seconds, and every ``sample_period`` seconds while one of
+    them is debouncing or held with repeat.
+
+    :param clock: time of the sampling and events, e.g. the game clock of the
+    backend
+    """
+
+    def __init__(self, sample_period=0.01, idle_period=0.02, debounce=0.03, hold_delay=0.5,
+                 hold_repeat=0.15, clock=time):
+        self.clock = clock
+        self.sample_period = sample_period
+        self.idle_period = idle_period
+        self.debounce = debounce
+        self.hold_delay = hold_delay
+        self.hold_repeat = hold_repeat
+
+        self.pins = {}
+        # Pins read by the sampling passes, all of them until listen()
+        self.listening = None
+        self._sampled = []
+        # Held by a sampling pass, listen() changes the pins between passes
+        self._lock = threading.Lock()
+        # {name: debounced state}, replaced as a whole after each sampling
+        # pass that changed it, so that reading it once is atomic
+        self.states = {}
+        self.events = queue.Queue()
+        # Optional callable receiving the events instead of self.events. It is
+        # called from the sampling thread.
+        self.listener = None
+        self._running = False
+        self._thread = None
+
+    def add_pin(self, name, io, active_low=True, repeat=False, debounce=None):
+        """:param debounce: s, the service debounce by default"""
+        if debounce is None:
+            debounce = self.debounce
+        pin = Pin(name, io, active_low=active_low, repeat=repeat, debounce=debounce)
+        # Start from the current level, an input already active at start up
+        # (e.g. a connected SOLA leg) does not produce a PRESS
+        pin.raw = pin.active = pin.read()
+        with self._lock:
+            self.pins[name] = pin
+            if self.listening is None or name in self.listening:
+                self._sampled = self._sampled + [pin]
+            self.states = {**self.states, name: pin.active}
+
+    def listen(self, names=None):
+        """
+        Sample only these inputs, e.g. the ones the current stage waits for.
+        The others keep their last state and send no events. An input
+        listened to again starts from its current level, without events, like
+        in add_pin().
+        :param names: input names, None for all
+        """
+        with self._lock:
+            listening = None if names is None else set(names)
+            sampled = [pin for name, pin in self.pins.items() if listening is None or name in listening]
+            for pin in sampled:
+                if pin not in self._sampled:
+                    pin.raw = pin.active = pin.read()
+                    pin.next_repeat = float("inf")
+            self.listening = listening
+            self._sampled = sampled
+            self.states = {name: pin.active for name, pin in self.pins.items()}
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="inputs", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+
+    def is_active(self, name):
+        """Debounced state of an input."""
+        return self.pins[name].active
+
+    def snapshot(self):
+        """:return: {name: debounced state} of all inputs, from one sampling pass"""
+        return self.states
+
+    def get(self, timeout=None):
+        """
+        Next input event.
+        :param timeout: seconds to wait, None blocks until an event arrives
+        :return: InputEvent, or None on timeout
+        """
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def clear(self):
+        """Drop events that were not consumed, e.g. when a stage starts."""
+        while True:
+            try:
+                self.events.get_nowait()
+            except queue.Empty:
+                return
+
+    def _emit(self, event):
+        if self.listener is not None:
+            self.listener(event)
+        else:
+            self.events.put(event)
+
+    def sample(self, now):
+        """
+        Read the listened inputs once and queue the resulting events.
+        :return: True if an input is debouncing or repeating, to be sampled
+        again soon
+        """
+        with self._lock:
+            events, busy = self._sample(now)
+        for event in events:
+            self._emit(event)
+        return busy
+
+    def _sample(self, now):
+        events = []
+        busy = False
+        for pin in self._sampled:
+            raw = pin.read()
+            if raw != pin.raw:
+                pin.raw = raw
+                pin.last_change = now
+
+            if raw != pin.active and now - pin.last_change >= pin.debounce:
+                pin.active = raw
+                if raw:
+                    events.append(InputEvent(pin.name, PRESS, now))
+                    pin.next_repeat = now + self.hold_delay
+                else:
+                    events.append(InputEvent(pin.name, RELEASE, now))
+                    pin.next_repeat = None
+            elif pin.active and pin.repeat and now >= pin.next_repeat:
+                events.append(InputEvent(pin.name, HOLD, now))
+                pin.next_repeat += self.hold_repeat
+            busy = busy or raw != pin.active or (pin.active and pin.repeat)
+
+        if events:
+            # The snapshot is up to date when the events are handled
+            self.states = {name: pin.active for name, pin in self.pins.items()}
+        return events, busy
+
+    def _run(self):
+        next_sample = self.clock.monotonic()
+        while self._running:
+            with metrics.timer("input_sample_seconds"):
+                busy = self.sample(self.clock.monotonic())
+            next_sample += self.sample_period if busy else self.idle_period
+            delay = next_sample - self.clock.monotonic()
+            if delay > 0:
+                self.clock.sleep(delay)
+            else:
+                # Fell behind (e.g. the process was suspended), do not burst
+                next_sample = self.clock.monotonic()
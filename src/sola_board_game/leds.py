@@ -0,0 +1,123 @@
+import threading
+import time
+
+import metrics
+
+# Default refresh rate of the LED strip, 60 Hz like the game loop
+FRAME_TIME = 1.0 / 60.0
+
+
+class Fade:
+    """Linear colour transition of one pixel, evaluated at each LED frame."""
+
+    def __init__(self, index, start, end, duration, start_time):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.duration = duration
+        self.start_time = start_time
+
+    def color(self, now):
+        if self.duration <= 0:
+            return self.end
+        factor = min((now - self.start_time) / self.duration, 1.0)
+        return tuple(int(s + (e - s) * factor) for s, e in zip(self.start, self.end))
+
+    def done(self, now):
+        return now - self.start_time >= self.duration
+
+
+class LedQueue:
+    """
+    Buffered NeoPixel writer.
+
+    Pixel writes are collected in a pending buffer and pushed by a background
+    thread with at most one ``pixels.show()`` per frame. Fades are scheduled
+    animations run by the same thread, so callers never sleep to let the
+    player see a change.
+
+    The NeoPixel object must be created with ``auto_write=False``.
+    """
+
+    def __init__(self, pixels, frame_time=FRAME_TIME):
+        self.pixels = pixels
+        self.frame_time = frame_time
+        self.n = len(pixels)
+        # Colour of each pixel once all pending writes are shown
+        self.colors = [(0,) * pixels.bpp] * self.n
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = {}
+        self._animations = {}
+        self._running = True
+
+        # Number of show() calls, i.e. transfers to the strip
+        self.shows = 0
+
+        self._thread = threading.Thread(target=self._run, name="leds", daemon=True)
+        self._thread.start()
+
+    def set(self, index, color):
+        """Queue a colour for one pixel, shown on the next LED frame."""
+        with self._lock:
+            self._animations.pop(index, None)
+            self._pending[index] = color
+            self.colors[index] = color
+        self._wake.set()
+
+    def fill(self, color):
+        with self._lock:
+            self._animations.clear()
+            for index in range(self.n):
+                self._pending[index] = color
+                self.colors[index] = color
+        self._wake.set()
+
+    def fade(self, index, color, duration):
+        """Move one pixel from its current colour to ``color`` in ``duration`` seconds."""
+        with self._lock:
+            start = self.colors[index]
+            self._animations[index] = Fade(index, start, color, duration, time.monotonic())
+            self.colors[index] = color
+        self._wake.set()
+
+    def busy(self):
+        """True while writes or animations are waiting to be shown."""
+        with self._lock:
+            return bool(self._pending or self._animations)
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+        self._thread.join()
+
+    def _collect(self, now):
+        with self._lock:
+            updates = self._pending
+            self._pending = {}
+            for index, fade in list(self._animations.items()):
+                updates[index] = fade.color(now)
+                if fade.done(now):
+                    del self._animations[index]
+            return updates
+
+    def _run(self):
+        while self._running:
+            # Sleep until something is queued, or the next animation frame
+            self._wake.wait(self.frame_time if self._animations else None)
+            self._wake.clear()
+            frame_start = time.monotonic()
+
+            updates = self._collect(frame_start)
+            if updates:
+                for index, color in updates.items():
+                    self.pixels[index] = color
+                with metrics.timer("led_show_seconds"):
+                    self.pixels.show()
+                self.shows += 1
+
+            # Coalesce writes arriving within the same frame
+            remaining = self.frame_time - (time.monotonic() - frame_start)
+            if remaining > 0:
+                time.sleep(remaining)
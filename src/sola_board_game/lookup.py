@@ -0,0 +1,159 @@
+"""
+Precomputed answers of the surface code game, persisted as .npy files and
+memory-mapped on later boots.
+
+Round table: for each of the 2**n_aux_qbs values of a packed syndrome round
+(256 for DISTANCE = 3), the NeoPixel colours, the logical flip expected from
+the Z syndrome alone and a hint text.
+
+Sample table: the logical flip of each sample of a sample store, decoded
+over all its rounds with the union-find decoder. It is rebuilt when the
+store is newer than the table.
+
+Both tables carry the signature of the stabilizer layout they were decoded
+with, as the title of their 'flip' field (the only metadata kept in the .npy
+header). A table of another layout is rebuilt instead of loaded.
+"""
+import hashlib
+import os
+
+import numpy as np
+
+from decoder import UnionFindDecoder
+from sample_generator import RotatedSurfaceCode
+from syndromes import rounds_to_colors, unpack_rounds
+
+# Round tables above this are too large to precompute
+MAX_AUX_QBS = 16
+HINT_LENGTH = 40
+
+
+def round_keys(packed):
+    """Table index of packed rounds (..., packed_width), little endian."""
+    packed = np.asarray(packed)
+    keys = np.zeros(packed.shape[:-1], dtype=np.intp)
+    for byte in range(packed.shape[-1]):
+        keys |= packed[..., byte].astype(np.intp) << (8 * byte)
+    return keys
+
+
+def layout_signature(code, n_rounds):
+    """:return: str identifying the stabilizers and logical operator of code"""
+    layout = np.concatenate([code.h_z, code.h_x, code.z_logical[None]])
+    return f"layout d{code.distance} r{n_rounds} {hashlib.sha1(layout.tobytes()).hexdigest()[:12]}"
+
+
+def table_signature(table):
+    """:return: layout signature of a table, None for a table without one"""
+    if table.dtype.names is None:
+        return None
+    field = table.dtype.fields[table.dtype.names[0]]
+    return field[2] if len(field) > 2 else None
+
+
+def build_round_table(distance, colors):
+    """
+    :param colors: (n_aux_qbs, bpp) colour of each auxiliary qubit
+    :return: structured array with fields 'flip', 'colors' and 'hint'
+    """
+    decoder = UnionFindDecoder(distance, n_rounds=0)
+    n_z = decoder.n_z
+    n_aux = 2 * n_z
+    if n_aux > MAX_AUX_QBS:
+        raise ValueError(f"round table of distance {distance} too large")
+    colors = np.asarray(colors, dtype=np.uint8)
+    keys = np.arange(2 ** n_aux)
+    packed = keys[:, None].astype("<u4").view(np.uint8)[:, :(n_aux + 7) // 8]
+    bits = unpack_rounds(packed, n_aux)
+
+    table = np.zeros(len(keys), dtype=[
+        ((layout_signature(decoder.code, 0), "flip"), "u1"),
+        ("colors", "u1", colors.shape),
+        ("hint", f"S{HINT_LENGTH}"),
+    ])
+    table["colors"] = rounds_to_colors(packed, colors, n_aux)
+    for key in keys:
+        z_fired = np.flatnonzero(bits[key, :n_z])
+        x_fired = np.flatnonzero(bits[key, n_z:])
+        flip = False
+        for idx in decoder.decode(z_fired.tolist()):
+            flip ^= decoder.edges[idx][2]
+        table["flip"][key] = flip
+        table["hint"][key] = f"{len(z_fired)} Z, {len(x_fired)} X fired: {'flip' if flip else 'keep'}".encode()
+    return table
+
+
+def build_sample_table(store, distance):
+    """
+    Logical flip of every sample of a SampleStore.
+    :return: structured array with the field 'flip'
+    """
+    n_rounds = len(store.rounds(0))
+    decoder = UnionFindDecoder(distance, n_rounds)
+    flips = np.zeros(len(store), dtype=[((layout_signature(decoder.code, n_rounds), "flip"), "u1")])
+    for index in range(len(store)):
+        flips["flip"][index] = decoder.sample_flip(store[index])
+    return flips
+
+
+def _load(path, build, signature, stale=lambda table: False):
+    """
+    Memory-map the table at path, (re)building and saving it if needed.
+    :param signature: layout signature the table must have
+    """
+    if os.path.exists(path):
+        table = np.load(path, mmap_mode="r")
+        if table_signature(table) != signature:
+            print(f"Rebuilding {path}, made for another stabilizer layout")
+        elif not stale(table):
+            return table
+    table = build()
+    tmp = path + ".tmp.npy"
+    np.save(tmp, table)
+    # Atomic, an interrupted build never leaves a broken table
+    os.replace(tmp, path)
+    return np.load(path, mmap_mode="r")
+
+
+class SyndromeLookup:
+    """
+    O(1) answers of the game.
+    :param path: round table file, e.g. "syndrome_lut_d3.npy"
+    :param store: optional SampleStore, its sample table is saved next to it
+    """
+
+    def __init__(self, distance, colors, path, store=None):
+        self.distance = distance
+        code = RotatedSurfaceCode(distance)
+        colors = np.asarray(colors, dtype=np.uint8)
+        self.rounds = _load(
+            path,
+            lambda: build_round_table(distance, colors),
+            layout_signature(code, 0),
+            # All checks fired shows every colour, rebuild if they changed
+            lambda table: not np.array_equal(table["colors"][-1], colors),
+        )
+        self.samples = None
+        if store is not None:
+            sample_path = store.path + ".answers.npy"
+            self.samples = _load(
+                sample_path,
+                lambda: build_sample_table(store, distance),
+                layout_signature(code, len(store.rounds(0))),
+                lambda table: len(table) != len(store)
+                or os.path.getmtime(sample_path) < os.path.getmtime(store.path),
+            )
+
+    def round_colors(self, packed):
+        """Colours of packed rounds, (..., n_aux_qbs, bpp)."""
+        return self.rounds["colors"][round_keys(packed)]
+
+    def round_hint(self, packed_round):
+        return self.rounds["hint"][round_keys(packed_round)].decode()
+
+    def round_flip(self, packed_round):
+        return bool(self.rounds["flip"][round_keys(packed_round)])
+
+    def sample_flip(self, index):
+        """Expected answer of sample ``index`` of the store."""
+        return bool(self.samples["flip"][index])
@@ -1,23 +1,65 @@
-import phdhat
+import argparse
+import asyncio
+import os
 
-# Set up system
-hat = phdhat.PhDHat()
+from importtime import ImportTimer
 
-hat.initial_stage()
-hat.sola_stage(phdhat.SOLA.THREE_DI) # ok
-hat.three_di_stage()
-hat.sola_stage(phdhat.SOLA.BIO) # not ok (open)
-hat.bio_stage()
+# Record the import time of every module, including the ones imported later
+# by the stages
+import_timer = ImportTimer().install()
 
-# tested
-hat.sola_stage(phdhat.SOLA.FRIDGE)
-hat.fridge_stage()
+import phdhat
+from engine import StageRunner
+from metrics import MetricsServer
+from screens import cache_dir
+from telemetry import Telemetry
 
-#
-hat.sola_stage(phdhat.SOLA.LIBQUDEV) # not ok (open)
-hat.libqudev_stage()
+parser = argparse.ArgumentParser(description="PhD hat game")
+parser.add_argument("--sim", action="store_true", help="run on simulated devices instead of the hat")
+parser.add_argument("--script", help="JSON input script for --sim, list of [time, input, value]")
+parser.add_argument("--speed", type=float, default=1.0,
+                    help="speed of the --sim game and its input script, > 1 runs faster than real time")
+parser.add_argument("--frames", help="directory where --sim saves the display frames as PNG")
+parser.add_argument("--import-report", help="save the import times of all modules to this JSON file")
+here = os.path.dirname(os.path.abspath(__file__))
+parser.add_argument("--telemetry", default=os.path.join(cache_dir(), "telemetry.bin"),
+                    help="telemetry log, appended to. Read it with telemetry.py")
+parser.add_argument("--verbose", action="store_true", help="print the telemetry messages")
+parser.add_argument("--metrics-port", type=int, help="serve the timing metrics on localhost:PORT/metrics")
+parser.add_argument("--metrics-socket", help="serve the timing metrics on this Unix socket")
+parser.add_argument("--game", default=os.path.join(here, "game.json"),
+                    help="stages and transitions of the game, JSON")
+parser.add_argument("--checkpoint", default=os.path.join(cache_dir(), "progress.json"),
+                    help="progress file, a restart resumes after the last completed stage")
+parser.add_argument("--new-game", action="store_true", help="ignore the saved progress")
+parser.add_argument("--start", help="state to start at")
+parser.add_argument("--skip", action="append", default=[], help="state to skip, can be repeated")
+args = parser.parse_args()
+
+# Set up system
+backend = None
+if args.sim:
+    from simulation import SimBackend
+    backend = SimBackend(frame_dir=args.frames, keep_frames=False, speed=args.speed)
+metrics_server = None
+if args.metrics_port or args.metrics_socket:
+    metrics_server = MetricsServer(port=args.metrics_port, socket_path=args.metrics_socket).start()
+telemetry = Telemetry(args.telemetry, echo=args.verbose)
+telemetry.start()
+hat = phdhat.PhDHat(backend=backend, telemetry=telemetry)
+print(f"Imports before the welcome screen:\n{import_timer.report(top=10)}")
+runner = StageRunner(hat, checkpoint=args.checkpoint)
+runner.load_game(args.game, skip=args.skip)
+if args.new_game:
+    runner.checkpoint.clear()
 
-hat.finish_stage()
-# keep_playing = hat.play_again()
-# while keep_playing:
-#     hat.surface_code_stage()
+if args.sim and args.script:
+    backend.play(SimBackend.load_script(args.script))
+try:
+    asyncio.run(runner.run(start=args.start))
+finally:
+    telemetry.stop()
+    if metrics_server is not None:
+        metrics_server.stop()
+    if args.import_report:
+        import_timer.save(args.import_report)
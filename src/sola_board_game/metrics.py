@@ -0,0 +1,200 @@
+"""
+Timing probes for the hot paths, aggregated as histograms in memory and
+served as Prometheus text so that a running hat can be scraped:
+
+    python main.py --metrics-port 9100
+    curl localhost:9100/metrics
+
+or, with --metrics-socket /tmp/phdhat.sock,
+
+    curl --unix-socket /tmp/phdhat.sock localhost/metrics
+
+Probes use the module registry:
+
+    with metrics.timer("display_flush_seconds"):
+        ...
+
+    @metrics.timed("plot_render_seconds", plot="freq")
+    def update_graph_plot(self, columns=None):
+        ...
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+import functools
+import os
+import threading
+import time
+
+# Upper bounds in seconds, for I2C transfers, drawing and sampling
+DEFAULT_BUCKETS = (0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+# For stages, which wait for the player
+STAGE_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """Cumulative-bucket histogram, like a Prometheus histogram."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # Per bucket, not cumulative, the last one is +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Registry of histograms, one per metric name and label set.
+    """
+
+    def __init__(self):
+        # name: (help, buckets)
+        self.definitions = {}
+        # (name, labels as a sorted tuple of pairs): Histogram
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def define(self, name, help_text="", buckets=DEFAULT_BUCKETS):
+        """Set the help text and buckets of a metric, before its first observation."""
+        self.definitions[name] = (help_text, tuple(buckets))
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                buckets = self.definitions.get(name, ("", DEFAULT_BUCKETS))[1]
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the duration of the with block, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name, **labels):
+        """Decorator observing the duration of each call."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def render(self):
+        """:return: all metrics in the Prometheus text exposition format"""
+        with self._lock:
+            snapshot = [(key, list(h.buckets), list(h.counts), h.sum, h.count)
+                        for key, h in sorted(self.histograms.items())]
+        lines = []
+        described = set()
+        for (name, labels), buckets, counts, total, count in snapshot:
+            if name not in described:
+                described.add(name)
+                help_text = self.definitions.get(name, ("",))[0]
+                if help_text:
+                    lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+            label_text = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + ["+Inf"], counts):
+                cumulative += bucket_count
+                bucket_labels = f'{label_text},le="{bound}"' if label_text else f'le="{bound}"'
+                lines.append(f"{name}_bucket{{{bucket_labels}}} {cumulative}")
+            suffix = f"{{{label_text}}}" if label_text else ""
+            lines.append(f"{name}_sum{suffix} {total:.9g}")
+            lines.append(f"{name}_count{suffix} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Registry used by the probes of the game
+registry = Metrics()
+define = registry.define
+observe = registry.observe
+timer = registry.timer
+timed = registry.timed
+
+define("display_flush_seconds", "FrameBuffer.flush(), packing and I2C transfer")
+define("display_flush_bytes", "Display data bytes per flush", buckets=(0, 16, 64, 128, 256, 512, 1024))
+define("led_show_seconds", "pixels.show() of the LED queue")
+define("plot_render_seconds", "Rendering of the bio plots")
+define("input_sample_seconds", "One sampling pass over the listened inputs")
+define("pause_seconds", "Sleeps of the stages, PhDHat.pause()",
+       buckets=(0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10))
+define("stage_seconds", "Duration of each game stage", buckets=STAGE_BUCKETS)
+
+
+class MetricsServer:
+    """
+    Serves the metrics over HTTP from a daemon thread.
+    :param port: TCP port on localhost
+    :param socket_path: Unix socket, used instead of the port if given
+    """
+
+    def __init__(self, metrics=registry, port=9100, socket_path=None):
+        # Imported here, the server is optional and not needed at start up
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        import socketserver
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = self.server.metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Scrapes are not logged, they would flood the console
+                pass
+
+        class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+            def get_request(self):
+                request, _ = super().get_request()
+                # BaseHTTPRequestHandler expects a (host, port) client address
+                return request, ("unix", 0)
+
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            self.server = UnixHTTPServer(socket_path, Handler)
+        else:
+            self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+            self.server.daemon_threads = True
+        self.server.metrics = metrics
+        self.socket_path = socket_path
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.socket_path is not None and os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
@@ -0,0 +1,36 @@
+"""
+Decoding of codes formed by several digital inputs, e.g. the libqudev cells.
+
+The code of N inputs is a string of N bits, the first input first ("10":
+first input active, second not), so that the puzzle tables read like the
+wiring.
+"""
+
+
+class PatternDecoder:
+    """
+    Maps the code of N inputs to messages.
+    :param names: input names, first one first in the code
+    :param messages: {code: message}, e.g. {"11": "Success"}
+    :param default: message of the codes missing from messages
+    """
+
+    def __init__(self, names, messages, default=None):
+        self.names = tuple(names)
+        for code in messages:
+            if len(code) != len(self.names) or set(code) - {"0", "1"}:
+                raise ValueError(f"Code {code!r} does not match {len(self.names)} inputs")
+        self.messages = dict(messages)
+        self.default = default
+
+    def code(self, states):
+        """
+        :param states: {name: active}, e.g. InputService.snapshot(), so that
+        all inputs are from the same sampling pass
+        """
+        return "".join("1" if states[name] else "0" for name in self.names)
+
+    def decode(self, states):
+        """:return: (code, message)"""
+        code = self.code(states)
+        return code, self.messages.get(code, self.default)
@@ -1,34 +1,89 @@
+import asyncio
+import os
 import time
 
-import adafruit_ssd1306
-import board
-import busio
-from digitalio import DigitalInOut, Direction, Pull
-import neopixel
-import numpy as np
-from PIL import ImageFont, ImageDraw, Image
-from gpiozero import DistanceSensor
-
-from bio import value_to_rgb, FreqPlot, NoisePlot
-
-PI_PIN_SOLA_3DI = board.D13
-PI_PIN_3DI = board.D19
-PI_PIN_3DI2 = board.D26
-
-
-PI_PIN_SOLA_BIO = board.D21
-PI_PIN_NEOPIXELS = board.D21
-
-PI_PIN_SOLA_FRIDGE = board.D16
-PI_PIN_FRIDGE = board.D12
-
-PI_PIN_SOLA_LIBQ = board.D25
-PI_PIN_LIBQ1 = board.D24
-PI_PIN_LIBQ2 = board.D18
-
-PI_PIN_EXTRA = board.D18
+# PIL is imported by the display and fonts factories, numpy and the plots by
+# the bio one in the background, the hardware modules by the backend, so that
+# the welcome screen does not wait for them
+from backends import HardwareBackend, PULL_UP, PULL_DOWN
+from devices import DeviceRegistry
+from distance import DistanceMonitor
+from leds import LedQueue
+from patterns import PatternDecoder
+from screens import ScreenCache, cache_dir
+import metrics
+from inputs import InputService, PRESS, HOLD
+from sola import SolaLeg, SolaWatcher
+from telemetry import Telemetry
+
+PI_PIN_SOLA_3DI = "D13"
+PI_PIN_3DI = "D19"
+PI_PIN_3DI2 = "D26"
+# HC-SR04 distance sensor of the 3Di leg, BCM numbers for gpiozero
+PI_TRIG_3DI = 19
+PI_ECHO_3DI = 26
+
+
+PI_PIN_SOLA_BIO = "D21"
+PI_PIN_NEOPIXELS = "D21"
+
+PI_PIN_SOLA_FRIDGE = "D16"
+PI_PIN_FRIDGE = "D12"
+
+PI_PIN_SOLA_LIBQ = "D25"
+PI_PIN_LIBQ1 = "D24"
+PI_PIN_LIBQ2 = "D18"
+
+PI_PIN_EXTRA = "D18"
+
+# Design cells chosen in the libqudev puzzle, code of the two inputs
+# (libqudev01 first) to message. Extend the inputs and codes to grow it.
+LIBQUDEV_INPUTS = ("libqudev01", "libqudev02")
+LIBQUDEV_SUCCESS = "11"
+LIBQUDEV_MESSAGES = {
+    "00": "Choose correct\ndesign cell(s)!",
+    "10": "Error: string\ncontains illegal\ncharacters",
+    "01": "Error: dupplicate\ncell name",
+    "11": "Success, you\nmastered\nlibqudev!",
+}
+
+# Buttons held together to bypass a stage, sampled in every stage
+BYPASS_INPUTS = ("a", "b")
+
+# Buttons of the hat, active low
+PI_PIN_BUTTONS = {
+    "a": "D5",
+    "b": "D6",
+    "l": "D27",
+    "r": "D23",
+    "u": "D17",
+    "d": "D22",
+    # Joystick center button
+    "c": "D4",
+}
 
 FONTPATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+
+# Pre-rendered static screens, see screens.py
+SCREEN_CACHE = os.path.join(cache_dir(), "screens.bin")
+# Texts shown full screen with the default font and position, they are
+# rendered once and then copied from the screen cache
+STATIC_SCREENS = (
+    "Welcome\nto your PhD hat\nPress #5 to start",
+    "Run QudevSola\nleg #1",
+    "Run QudevSola\nleg #2",
+    "Run QudevSola\nleg #3",
+    "Run QudevSola\nleg #4",
+    "1. Level flip\n-chip hat",
+    "Congrats,\nyour sample\nis leveled.",
+    "2. Tune\nQubit frequencies",
+    "Starting BF1\n cooldown...\nV15 issue!",
+    "Valve fixed!",
+    *LIBQUDEV_MESSAGES.values(),
+    "You made it!\nMove to\ntreasure",
+    "Code hint:\nQudev Sola #",
+    "Play again?\nPress #5 to start",
+)
 # Tick rate for sleeping between checking the buttons, 60 Hz
 FRAME_TIME = 1.0/60.0
 
@@ -50,148 +105,245 @@ class SOLA:
              LIBQUDEV: PI_PIN_SOLA_LIBQ}
 
 
+# How each SOLA leg is wired and how long sola_stage waits for it. The bio
+# leg brings its pin high, the others low. Without a connection, the bio and
+# libqudev legs are bypassed after their timeout.
+SOLA_LEGS = {
+    SOLA.THREE_DI: SolaLeg("3Di", "sola_three_di", PI_PIN_SOLA_3DI, active_low=True, debounce=0.03, timeout=None),
+    SOLA.BIO: SolaLeg("Bio", "sola_bio", PI_PIN_SOLA_BIO, active_low=False, debounce=0.03, timeout=10),
+    SOLA.FRIDGE: SolaLeg("fridge", "sola_fridge", PI_PIN_SOLA_FRIDGE, active_low=True, debounce=0.03, timeout=None),
+    SOLA.LIBQUDEV: SolaLeg("libqudev", "sola_libqudev", PI_PIN_SOLA_LIBQ, active_low=True, debounce=0.03,
+                           timeout=15),
+}
+# Inputs of all the SOLA legs, sampled together while a leg is expected
+SOLA_INPUTS = tuple(leg.input for leg in SOLA_LEGS.values())
+
+
 class PhDHat:
 
-    def __init__(self):
+    def __init__(self, backend=None, telemetry=None, screen_cache=SCREEN_CACHE):
+        """
+        :param backend: creates the devices, HardwareBackend by default. Use
+        simulation.SimBackend to run without the hat.
+        :param telemetry: Telemetry recorder for inputs, sensors, screens and
+        stages, in memory only by default
+        :param screen_cache: file of the pre-rendered static screens, None
+        keeps them in memory only
+        """
+        if backend is None:
+            backend = HardwareBackend()
+        self.backend = backend
+        # Pauses, timeouts and timers are in game seconds, see backends.Clock
+        self.clock = backend.clock
+        if telemetry is None:
+            telemetry = Telemetry()
+        self.telemetry = telemetry
+        # Connection times of the SOLA legs, fed by the input events
+        self.sola = SolaWatcher(SOLA_LEGS, telemetry=telemetry, clock=self.clock)
+        init_start = time.perf_counter()
         # configure software bypass. Set to False to run in normal mode with the hat
         self.software_bypass = False
 
         self.state = "pre-initialize"
-        self.pixels = neopixel.NeoPixel(
+        self.disp_width = 128
+        self.disp_height = 64
+        self.screen_cache = screen_cache
+
+        # Devices are created on first use, the display first so that the
+        # welcome screen does not wait for the other peripherals
+        self.devices = DeviceRegistry()
+        self.devices.register("display", self._init_display)
+        self.devices.register("fonts", self._init_fonts)
+        self.devices.register("leds", self._init_leds)
+        self.devices.register("inputs", self._init_inputs)
+        self.devices.register("bio", self._init_bio)
+        # Built once, on the first level flip stage
+        self.devices.register(
+            "distance", lambda: backend.distance_sensor(echo=PI_ECHO_3DI, trigger=PI_TRIG_3DI))
+        self.devices.register(
+            "distance_monitor", lambda: DistanceMonitor(self.devices.get("distance"), min_cm=24, max_cm=28,
+                                                telemetry=self.telemetry, clock=self.clock))
+
+        # Set by attach_loop() when the stages run on an asyncio loop
+        self.loop = None
+        self.events = None
+        self.bypass = None
+        self._listener = None
+
+        self.led_indices = {
+            "q3":  0,
+            "dark": 1,
+            "q1":  2,
+            "bright":  3,
+            "q2":  4,
+        }
+
+        self.devices.get("display")
+        self.devices.get("fonts")
+        self.devices.warm_up(["leds", "inputs", "bio"])
+        print(f"Hat ready to draw {time.perf_counter() - init_start:.2f} s after start up")
+
+    def _init_display(self):
+        from display import FrameBuffer
+        # Create the SSD1306 OLED class.
+        self.disp = self.backend.display(self.disp_width, self.disp_height)
+        # Persistent canvas, only changed pages are sent over I2C on flush
+        self.fb = FrameBuffer(self.disp)
+        # Clear the display
+        self.fb.clear()
+        self.fb.flush(force=True)
+        return self.disp
+
+    def _init_fonts(self):
+        from fonts import ATLAS_VERSION, FontCache
+        # Font for text display, fonts are cached and text of the common
+        # sizes is drawn from pre-rasterised glyphs
+        self.fonts = FontCache(FONTPATH)
+        self.font_size = 15
+        self.font = self.fonts.get(self.font_size)
+        self.screens = ScreenCache(
+            self.screen_cache,
+            frame_size=self.disp_width * self.disp_height // 8,
+            signature=f"{self.disp_width}x{self.disp_height} {FONTPATH} {self.font_size} atlas {ATLAS_VERSION}",
+        )
+        return self.fonts
+
+    def _init_leds(self):
+        pixels = self.backend.pixels(
             PI_PIN_NEOPIXELS,
             NEOPIXEL_COUNT,
             brightness=0.2,
-            # auto_write=False,
-            pixel_order=neopixel.GRBW,
-        )
-        # Create the I2C interface.
-        self.i2c = busio.I2C(board.SCL, board.SDA)
-        # Create the SSD1306 OLED class.
-        self.disp_width = 128
-        self.disp_height = 64
-        self.disp = adafruit_ssd1306.SSD1306_I2C(
-            self.disp_width,
-            self.disp_height,
-            self.i2c,
+            pixel_order="GRBW",
         )
-        self.draw = None
-        self.image = None
+        # Pixel writes are buffered and shown by a background thread
+        leds = LedQueue(pixels, frame_time=FRAME_TIME)
+        # Clear the neopixels
+        leds.fill((0, 0, 0))
+        return leds
 
-        # Font for text display
-        self.font =  ImageFont.truetype(FONTPATH, 15)
+    def _init_bio(self):
+        # The plots and LED colours of bio_stage, with numpy
+        import bio
+        return bio
 
+    def _init_inputs(self):
+        backend = self.backend
         # Create the buttons
-        # Default state is high (True)
-        self.button_a = DigitalInOut(board.D5)
-        self.button_b = DigitalInOut(board.D6)
-        self.button_l = DigitalInOut(board.D27)
-        self.button_r = DigitalInOut(board.D23)
-        self.button_u = DigitalInOut(board.D17)
-        self.button_d = DigitalInOut(board.D22)
-        # Joystick center button
-        self.button_c = DigitalInOut(board.D4)
-
-        # SOLA IO
-        self.sola_three_di_input = DigitalInOut(PI_PIN_SOLA_3DI)
-        self.sola_bio_input = DigitalInOut(PI_PIN_SOLA_BIO)
-        # could directly provide power to IC circuit ?
-        self.sola_fridge_input = DigitalInOut(PI_PIN_SOLA_FRIDGE)
-        self.sola_libqudev_input = DigitalInOut(PI_PIN_SOLA_LIBQ)
+        # Default state is high (True), ground the pin to bring the value low
+        self.button_a = backend.pin(PI_PIN_BUTTONS["a"], PULL_UP, name="a")
+        self.button_b = backend.pin(PI_PIN_BUTTONS["b"], PULL_UP, name="b")
+        self.button_l = backend.pin(PI_PIN_BUTTONS["l"], PULL_UP, name="l")
+        self.button_r = backend.pin(PI_PIN_BUTTONS["r"], PULL_UP, name="r")
+        self.button_u = backend.pin(PI_PIN_BUTTONS["u"], PULL_UP, name="u")
+        self.button_d = backend.pin(PI_PIN_BUTTONS["d"], PULL_UP, name="d")
+        self.button_c = backend.pin(PI_PIN_BUTTONS["c"], PULL_UP, name="c")
+
+        # SOLA IO, e.g. self.sola_bio_input, see SOLA_LEGS
+        for leg in SOLA_LEGS.values():
+            setattr(self, f"{leg.input}_input", backend.pin(leg.pin, PULL_UP, name=leg.input))
 
         # 3Di IO
-        self.three_di_input = DigitalInOut(PI_PIN_3DI)
+        self.three_di_input = backend.pin(PI_PIN_3DI, PULL_UP, name="three_di")
 
-        # LibQudev IO
-        self.libqudev01_input = DigitalInOut(PI_PIN_LIBQ1)
-        self.libqudev02_input = DigitalInOut(PI_PIN_LIBQ2)
+        # LibQudev IO, both need to be configured in pull down mode
+        self.libqudev01_input = backend.pin(PI_PIN_LIBQ1, PULL_DOWN, name="libqudev01")
+        self.libqudev02_input = backend.pin(PI_PIN_LIBQ2, PULL_DOWN, name="libqudev02")
 
         # Bio IOs
         # none
 
         # Fridge IOs
-        self.fridge_input = DigitalInOut(PI_PIN_FRIDGE)
-
-        inputs = [
-            self.button_a,
-            self.button_b,
-            self.button_l,
-            self.button_r,
-            self.button_u,
-            self.button_d,
-            self.button_c,
-            self.sola_three_di_input,
-            self.sola_bio_input,
-            self.sola_fridge_input,
-            self.sola_libqudev_input,
-            self.libqudev01_input,
-            self.libqudev02_input,
-            self.fridge_input
-        ]
-        for inp in inputs:
-            inp.direction = Direction.INPUT
-            inp.pull = Pull.UP
-            # Ground the pin to bring the value low (False)
-
-        # for inp in [self.fridge_input]:
-        for inp in [ self.libqudev01_input, self.libqudev02_input]:
-            inp.direction = Direction.INPUT
-            inp.pull = Pull.DOWN
-        # Clear the display
-        self.disp.fill(0)
-        self.disp.show()
-
-        # Clear the neopixels
-        self.pixels.fill((0, 0, 0))
-        # self.pixels.show()
-
-        self.led_indices = {
-            "q3":  0,
-            "dark": 1,
-            "q1":  2,
-            "bright":  3,
-            "q2":  4,
-        }
-
+        self.fridge_input = backend.pin(PI_PIN_FRIDGE, PULL_UP, name="fridge")
+
+        # All inputs are sampled and debounced in one place, stages consume
+        # the resulting events. active_low follows the wiring of each input.
+        inputs = InputService(clock=self.clock)
+        for name, inp, active_low, repeat in [
+            ("a", self.button_a, True, False),
+            ("b", self.button_b, True, False),
+            ("l", self.button_l, True, True),
+            ("r", self.button_r, True, True),
+            ("u", self.button_u, True, True),
+            ("d", self.button_d, True, True),
+            ("c", self.button_c, True, False),
+            ("libqudev01", self.libqudev01_input, False, False),
+            ("libqudev02", self.libqudev02_input, False, False),
+            ("fridge", self.fridge_input, False, False),
+        ]:
+            inputs.add_pin(name, inp, active_low=active_low, repeat=repeat)
+        for leg in SOLA_LEGS.values():
+            inputs.add_pin(leg.input, getattr(self, f"{leg.input}_input"), active_low=leg.active_low,
+                           debounce=leg.debounce)
+        # Events go to the loop attached at the time, see attach_loop()
+        inputs.listener = self._forward_event
+        inputs.start()
+        return inputs
+
+    @property
+    def leds(self):
+        return self.devices.get("leds")
+
+    @property
+    def pixels(self):
+        return self.leds.pixels
+
+    @property
+    def inputs(self):
+        return self.devices.get("inputs")
 
     def _display_text_on_screen(
-        self, text: str, new_screen=True, font: ImageFont = None,
+        self, text: str, new_screen=True, font: "ImageFont.FreeTypeFont" = None,
             font_size: None = None, position: tuple = None, anchor="mm",
-            sleep: int = 0
+            sleep: int = 0, flush: bool = True,
     ) -> None:
-        # Create blank image for drawing.
-        # Make sure to create image with mode '1' for 1-bit color.
-        width = self.disp.width
-        height = self.disp.height
-        print(text)
+        # Draw on the persistent frame buffer. With flush=False the text is
+        # only drawn, and is sent together with later draws on the next flush.
+        self.telemetry.text("display.text", text)
+        # Static screens are copied from the cache, see STATIC_SCREENS
+        static = (new_screen and font is None and font_size is None and position is None
+                  and anchor == "mm" and text in STATIC_SCREENS)
+        if static:
+            frame = self.screens.get(text)
+            if frame is not None:
+                self.fb.load_packed(frame)
+                if flush:
+                    self.fb.flush()
+                if sleep:
+                    self.clock.sleep(sleep)
+                return
+
         if new_screen:
             # Fill with black by default
-            self.image = Image.new("1", (width, height), color=0)
+            self.fb.clear()
 
-            # Get drawing object to draw on image.
-            self.draw = ImageDraw.Draw(self.image)
-            # Draw a black filled box to clear the image.
-            # self.draw.rectangle((0, 0, width, height), outline=1, fill=1)
-
-        if font_size is not None:
-            font = ImageFont.truetype(FONTPATH, font_size)
-        elif font is None:
-            font = self.font
         if position is None:
             position = (self.disp_width / 2, self.disp_height / 2)
 
-        self.draw.text(
-            position,
-            text,
-            font=font,
-            anchor=anchor,
-            fill=1,  # white text
-        )
-
-        self.disp.image(self.image)
-        self.disp.show()
+        if font_size is None and font is not None:
+            self.fb.draw.text(
+                position,
+                text,
+                font=font,
+                anchor=anchor,
+                fill=1,  # white text
+            )
+        else:
+            self.fonts.draw_text(
+                self.fb.draw,
+                position,
+                text,
+                size=font_size or self.font_size,
+                anchor=anchor,
+                fill=1,  # white text
+            )
+        if static:
+            self.screens.add(text, self.fb.packed())
+
+        if flush:
+            self.fb.flush()
 
         if sleep:
-            time.sleep(sleep)
+            self.clock.sleep(sleep)
 
     def _display_surface_board_cycle(
             self, score: int, n_rounds: int, streak: int,
@@ -199,14 +351,15 @@ class PhDHat:
     ) -> None:
         text = f"Score: {score}/{n_rounds}\nStreak: {streak}"
         position=(40, 18)
+        # Single I2C transfer for the three draws
         self._display_text_on_screen(
             text, new_screen=True,
-            font_size=11, position=position,
+            font_size=11, position=position, flush=False,
         )
 
         self._display_text_on_screen(
             f'Cycle: {cycle}', new_screen=False,
-            position=(64, 40)
+            position=(64, 40), flush=False,
         )
         self._display_text_on_screen(
             'L/R to scroll',
@@ -222,8 +375,7 @@ class PhDHat:
         # self.pixels[1] = (0, 255, 0)
         # self.pixels[2] = (0, 0, 255)
         # self.pixels[3] = (255, 255, 0)
-        self.pixels[4] = (0, 255, 255)
-        self.pixels.show()
+        self.leds.set(4, (0, 255, 255))
         # time.sleep(2)
         # self.pixels.fill((0, 255, 0))
         # self.pixels.show()
@@ -256,103 +408,38 @@ class PhDHat:
             # self.light_neopixels(mask, colors)
             # time.sleep(3)
 
-    def initial_stage(self):
+    async def initial_stage(self):
         print('Initial stage ...')
         # Display welcome text
         self._display_text_on_screen(
             "Welcome\nto your PhD hat\nPress #5 to start",
-            sleep=1,
         )
-        self.pixels.fill((0, 0, 0))
+        self.leds.fill((0, 0, 0))
         # self._led_test()
-        while True:
-            # If A button pressed (value brought low)
-            if not self.button_a.value:
-                return
-            elif self.check_bypasses():
-                return
-            else:
-                time.sleep(FRAME_TIME)
+        # Wait for the A button (or the bypass)
+        await self.wait_for_input("a")
 
-    def sola_stage(self, pin):
+    async def sola_stage(self, pin):
+        leg = SOLA_LEGS[pin]
         print(f'sola stage with pin {pin}...')
-        msg = f'Run QudevSola\nleg #{pin}'
-        match pin:
-            case SOLA.THREE_DI:
-                self._display_text_on_screen(msg)
-                print('Waiting for connection to 3Di...')
-                while True:
-                    # If 3di connection made (value brought low)
-                    if not self.sola_three_di_input.value:
-                        print('Connection found!')
-                        return
-                    # bypass If A and B pressed (brought low)
-                    elif self.check_bypasses():
-                        return
-                    else:
-                        time.sleep(FRAME_TIME)
-            case SOLA.BIO:
-                self._display_text_on_screen(msg)
-                bypass = True
-                print('Waiting for connection to Bio...')
-                while True:
-                    # If 3di connection made (value brought low)
-                    if self.sola_bio_input.value:
-                        print('Connection found!')
-                        return
-                    # bypass If A and B pressed (brought low)
-                    elif self.check_bypasses():
-                        return
-                    elif bypass:
-                        print('bypassing')
-                        time.sleep(10)
-                        return
-                    else:
-                        time.sleep(FRAME_TIME)
-            case SOLA.FRIDGE:
-                self._display_text_on_screen(msg)
-                print('Waiting for connection to fridge...')
-                while True:
-                    # If 3di connection made (value brought low)
-                    if not self.sola_fridge_input.value:
-                        print('Connection found!')
-                        return
-                    # bypass If A and B pressed (brought low)
-                    elif self.check_bypasses():
-                        return
-                    else:
-                        time.sleep(FRAME_TIME)
-            case SOLA.LIBQUDEV:
-                self._display_text_on_screen(msg)
-                print('Waiting for connection to libqudev...')
-                bypass = True
-                while True:
-                    # If 3di connection made (value brought low)
-                    if not self.sola_libqudev_input.value:
-                        print('Connection found!')
-                        return
-                    # bypass If A and B pressed (brought low)
-                    elif self.check_bypasses():
-                        return
-                    elif bypass:
-                        print("bypassing")
-                        time.sleep(15)
-                        return
-                    else:
-                        time.sleep(FRAME_TIME)
+        self._display_text_on_screen(f'Run QudevSola\nleg #{pin}')
+        print(f'Waiting for connection to {leg.label}...')
+        # Returns as soon as the leg is connected, see SOLA_LEGS for the
+        # polarity and how long to wait before bypassing it. All legs are
+        # sampled, so that the watcher also sees the other ones connect.
+        self.sola.expect(pin)
+        if await self.wait_for_input(leg.input, timeout=leg.timeout, also=SOLA_INPUTS):
+            print(f'Connection found after {self.sola.connected(pin):.1f} s!')
+        else:
+            self.sola.cancel(pin)
+            print('bypassing')
 
-    def three_di_stage(self):
+    async def three_di_stage(self):
         # Display message
         self._display_text_on_screen(
             "1. Level flip\n-chip hat",
-            sleep=3
         )
-        # Define the GPIO pins for the HC-SR04 sensor
-        TRIG = 19
-        ECHO = 26
-
-        # Set the GPIO mode
-        ultrasonic = DistanceSensor(echo=ECHO, trigger=TRIG)
+        await self.pause(3)
 
         # Define the distance range
         MIN_DISTANCE = 24  # Minimum distance in cm
@@ -362,64 +449,61 @@ class PhDHat:
         TIMER_DURATION = 10  # Countdown timer duration in seconds
         SUCCESS_STR = "Congrats,\nyour sample\nis leveled."
 
-        def measure_distance():
-            """Measure the distance using the HC-SR04 sensor."""
-            distance = ultrasonic.distance
-            # Round and convert to str
-            # Convert meters to centimeters
-            distance_cm = distance * 100
-            # Round to 1 decimal place and format as a string
-            distance_cm_str = f"{distance_cm:.1f}"
-
-            return distance, distance_cm_str
-
-        output_str = ""
-        countdown_timer = None
-        countdown_start_time = None
-
-        # Needs to be modified such that PRINT_FUNC prints the output_str
-        while output_str != SUCCESS_STR:
-
-            distance, distance_cm_str = measure_distance()
-
-            if MIN_DISTANCE <= distance*100 <= MAX_DISTANCE:
-                if countdown_timer is None:
-                    countdown_timer = TIMER_DURATION
-                    countdown_start_time = time.time()
-                    elapsed_time = time.time() - countdown_start_time
-                    remaining_time = TIMER_DURATION - elapsed_time
-                    output_str = f"Keep level!\nDist: {distance_cm_str} cm, Timer: {int(remaining_time)}s"
-                else:
-                    elapsed_time = time.time() - countdown_start_time
-                    remaining_time = TIMER_DURATION - elapsed_time
+        # HC-SR04 sensor, created on the first call and sampled in the
+        # background while the stage runs
+        monitor = self.devices.get("distance_monitor")
+        monitor.min_cm = MIN_DISTANCE
+        monitor.max_cm = MAX_DISTANCE
+        monitor.start()
+
+        shown_str = None
+        try:
+            while True:
+                distance_cm, level, level_since = monitor.state()
+                if distance_cm is None:
+                    output_str = shown_str
+                elif level:
+                    # The countdown starts when the sample becomes level
+                    remaining_time = TIMER_DURATION - (self.clock.monotonic() - level_since)
                     if remaining_time <= 0:
                         output_str = SUCCESS_STR
                     else:
-                        output_str = f"Keel level!\nDist: {distance_cm_str} cm,\nTimer: {int(remaining_time)}s"
-            else:
-                countdown_timer = None
-                countdown_start_time = None
-                output_str = f"Sample not\nleveled.\nDist: {distance_cm_str} cm."
-                print(MIN_DISTANCE, distance*100, MAX_DISTANCE)
-            self._display_text_on_screen(output_str)
-
-            if self.check_bypasses():
-                return
-            time.sleep(0.3)
-
-    def bio_stage(self):
+                        output_str = f"Keep level!\nDist: {distance_cm:.1f} cm,\nTimer: {int(remaining_time)}s"
+                else:
+                    output_str = f"Sample not\nleveled.\nDist: {distance_cm:.1f} cm."
+
+                # Only redraw when the shown distance or timer digit changed
+                if output_str != shown_str:
+                    self._display_text_on_screen(output_str)
+                    shown_str = output_str
+                if output_str == SUCCESS_STR:
+                    return
+
+                if self.check_bypasses():
+                    return
+                if await self.pause(FRAME_TIME):
+                    return
+        finally:
+            monitor.stop()
+
+    async def bio_stage(self):
+        import numpy as np
+        from PIL import ImageDraw, Image
+        bio = self.devices.get("bio")
+        self.listen("l", "r", "u", "d")
         # Light all LEDs yellow to match the figure
         # for led_key in self.led_indices:
         #     self.pixels[self.led_indices[led_key]] = (128, 128, 0)
         # Display message
         self._display_text_on_screen(
-            "2. Tune\nQubit frequencies", sleep=3,
+            "2. Tune\nQubit frequencies",
         )
+        await self.pause(3)
         success = False
         # initialize
         # Clear display.
-        self.disp.fill(0)
-        self.disp.show()
+        self.fb.clear()
+        self.fb.flush()
 
         # Create blank image for drawing.
         # Make sure to create image with mode '1' for 1-bit color.
@@ -430,52 +514,38 @@ class PhDHat:
         # print('width = %d' % width)
         # print('height = %d' % height)
 
-        freq_plot = FreqPlot(w=width, h=height, buffer=16, nb_pts=3)
-        noise_plot = NoisePlot(w=width, h=height, buffer=16, nb_pts=14)
+        freq_plot = bio.FreqPlot(w=width, h=height, buffer=16, nb_pts=3)
+        noise_plot = bio.NoisePlot(w=width, h=height, buffer=16, nb_pts=14)
 
-        self.disp.image(freq_plot.main_img)
-        self.disp.show()
+        self.fb.show_image(freq_plot.main_img)
+        freq_plot.take_dirty()
 
         success = False
 
         # Init qubit pixels
-        for label, freq in zip(freq_plot.labels, freq_plot.values):
-            rgb = value_to_rgb(1 - freq) + (0,)
-            self.light_up_pixel(self.led_indices[label], rgb)
+        self.light_up_pixels(freq_plot.labels, bio.values_to_rgbw(1 - np.asarray(freq_plot.values)))
 
         # Start the first game
+        self.reset_events()
         while not success:
-            if not self.button_r.value:
-                freq_plot.update_marker(1)
-
-            if not self.button_l.value:
-                freq_plot.update_marker(-1)
-
-            # Update frequency
-            if not self.button_u.value:
-                freq_plot.update_value(-0.1)
-                for label, freq in zip(freq_plot.labels, freq_plot.values):
-                    rgb = value_to_rgb(1-freq) + (0,)
-                    self.light_up_pixel(self.led_indices[label], rgb)
-
-            # Update frequency
-            if not self.button_d.value:
-                freq_plot.update_value(0.1)
-                for label, freq in zip(freq_plot.labels, freq_plot.values):
-                    rgb = value_to_rgb(1-freq) + (0,)
-                    self.light_up_pixel(self.led_indices[label], rgb)
+            # Sleep until the next input event, one step per press
+            event = await self.next_event()
+            if event.kind == PRESS:
+                if event.name == "r":
+                    freq_plot.update_marker(1)
+
+                if event.name == "l":
+                    freq_plot.update_marker(-1)
+
+                # Update frequency
+                if event.name in ("u", "d"):
+                    freq_plot.update_value(-0.1 if event.name == "u" else 0.1)
+                    self.light_up_pixels(freq_plot.labels, bio.values_to_rgbw(1 - np.asarray(freq_plot.values)))
 
             # First two qubits resonant condition
             if freq_plot.values[0] == freq_plot.values[1]:
-                # Bright state goes bright
-                brightness = 1
-                rgb_bright = value_to_rgb(1-(freq_plot.values[1] - freq_plot.hybridization)) + (0,)
-                self.light_up_pixel(self.led_indices['bright'], tuple(int(i*brightness) for i in rgb_bright))
-
-                # Dark state goes dark
-                darkness = 0.05
-                rgb_dark = value_to_rgb(1-(freq_plot.values[1] + freq_plot.hybridization)) + (0,)
-                self.light_up_pixel(self.led_indices['dark'], tuple(int(i*darkness) for i in rgb_dark))
+                # Bright state goes bright, dark state goes dark
+                self._light_up_hybridized(freq_plot, brightness=1, darkness=0.05)
 
                 # Game 1 done condition
                 if freq_plot.values[2] == freq_plot.values[1] + freq_plot.hybridization:
@@ -483,199 +553,271 @@ class PhDHat:
                     success_img = Image.new('1', (width, height))
                     success_draw = ImageDraw.Draw(success_img)
                     success_draw.text((16, 32), 'First game done! :)', fill=1)
-                    self.disp.image(success_img)
-                    self.disp.show()
-                    time.sleep(3)
+                    self.fb.show_image(success_img)
+                    await asyncio.sleep(self.clock.real(3))
                     success = True
 
-            self.disp.image(freq_plot.main_img)
-            self.disp.show()
+            # Only the re-rendered columns are compared and sent
+            box = freq_plot.take_dirty()
+            if box is not None:
+                self.fb.show_image(freq_plot.main_img, box=box)
             if self.check_bypasses():
                 break
 
         # Start the Noise shaping game
-        self.disp.image(noise_plot.main_img)
-        self.disp.show()
-        time.sleep(2)
+        self.fb.show_image(noise_plot.main_img)
+        noise_plot.take_dirty()
+        await asyncio.sleep(self.clock.real(2))
 
         success = False
         print('second game')
+        self.reset_events()
         while not success:
+            # Sleep until the next input event, holding a button repeats
+            event = await self.next_event()
             success = self.check_bypasses()
-            if not self.button_r.value:
+            step = event.kind in (PRESS, HOLD)
+            if step and event.name == "r":
                 noise_plot.update_marker(1)
 
-            if not self.button_l.value:
+            if step and event.name == "l":
                 noise_plot.update_marker(-1)
 
             # Update power
-            if not self.button_u.value:
+            if step and event.name == "u":
                 noise_plot.update_value(-0.1)
                 # Update the LED with brightness and darkness mapped to the distance
-                brightness = noise_plot.current_distance*3 + 0.1
-                if brightness > 1:
-                    brightness = 1
-                rgb_bright = value_to_rgb(1-(freq_plot.values[1] - freq_plot.hybridization)) + (0,)
-                self.light_up_pixel(self.led_indices['bright'], tuple(int(i * brightness) for i in rgb_bright))
-
-                # Dark state goes dark
-                darkness = 1 - noise_plot.current_distance*3 - 0.1
-                if darkness < 0:
-                    darkness = 0
-                rgb_dark = value_to_rgb(1-(freq_plot.values[1] + freq_plot.hybridization)) + (0,)
-                self.light_up_pixel(self.led_indices['dark'], tuple(int(i*darkness) for i in rgb_dark))
-
-            if not self.button_d.value:
+                self._light_up_hybridized(
+                    freq_plot,
+                    brightness=noise_plot.current_distance*3 + 0.1,
+                    darkness=1 - noise_plot.current_distance*3 - 0.1,
+                )
+
+            if step and event.name == "d":
                 noise_plot.update_value(0.1)
 
                 # Update the LED with brightness and darkness mapped to the distance
-                brightness = noise_plot.current_distance*3 + 0.1
-                if brightness > 1:
-                    brightness = 1
-                rgb_bright = value_to_rgb(1-(freq_plot.values[1] - freq_plot.hybridization)) + (0,)
-                self.light_up_pixel(self.led_indices['bright'], tuple(int(i * brightness) for i in rgb_bright))
-
-                # Dark state goes dark
-                darkness = 1 - noise_plot.current_distance*3 - 0.1
-                if darkness < 0:
-                    darkness = 0
-
-                rgb_dark = value_to_rgb(1-(freq_plot.values[1] + freq_plot.hybridization)) + (0,)
-                self.light_up_pixel(self.led_indices['dark'], tuple(int(i*darkness) for i in rgb_dark))
+                self._light_up_hybridized(
+                    freq_plot,
+                    brightness=noise_plot.current_distance*3 + 0.1,
+                    darkness=1 - noise_plot.current_distance*3 - 0.1,
+                )
 
             if noise_plot.current_distance <= 0.15:
                 print('Second game done!')
                 success_img = Image.new('1', (width, height))
                 success_draw = ImageDraw.Draw(success_img)
                 success_draw.text((16, 32), 'Second game done! :)', fill=1)
-                self.disp.image(success_img)
-                self.disp.show()
-                time.sleep(3)
+                self.fb.show_image(success_img)
+                await asyncio.sleep(self.clock.real(3))
                 success = True
                 return
 
-            self.disp.image(noise_plot.main_img)
-            self.image = noise_plot.main_img
-            self.disp.show()
+            box = noise_plot.take_dirty()
+            if box is not None:
+                self.fb.show_image(noise_plot.main_img, box=box)
 
             # TO BE IMPLEMENTED: success check
 
-            time.sleep(FRAME_TIME)
+    def _light_up_hybridized(self, freq_plot, brightness, darkness):
+        """
+        Light the bright and dark state LEDs of the two resonant qubits.
+        :param brightness: scaling of the bright state colour, clipped to [0, 1]
+        :param darkness: scaling of the dark state colour, clipped to [0, 1]
+        """
+        value = freq_plot.values[1]
+        colors = self.devices.get("bio").values_to_rgbw(
+            [1 - (value - freq_plot.hybridization), 1 - (value + freq_plot.hybridization)],
+            scale=[brightness, darkness],
+        )
+        self.light_up_pixels(['bright', 'dark'], colors)
+
+    def light_up_pixels(self, keys, colors, fade=0.1):
+        """
+        Queue colours for several LEDs.
+        :param keys: LED names, see self.led_indices
+        :param colors: one colour per key, e.g. from values_to_rgbw
+        """
+        for key, color in zip(keys, colors):
+            self.light_up_pixel(self.led_indices[key], tuple(int(c) for c in color), fade=fade)
 
-    def light_up_pixel(self, index, color):
-        print(f"Lighting up pixel {index} with color {color}.")
-        self.pixels[index] = color
-        self.pixels.show()
-        time.sleep(0.1)  # Add a delay to see the change
+    def light_up_pixel(self, index, color, fade=0.1):
+        """
+        Queue a pixel colour change, does not block the game loop.
+        :param fade: duration in seconds of the transition from the current
+        colour, so that the player sees the change
+        """
+        # Colour channels packed into one int, first channel highest
+        self.telemetry.record(f"led{index}", int.from_bytes(bytes(color), "big"))
+        if fade:
+            self.leds.fade(index, color, fade)
+        else:
+            self.leds.set(index, color)
 
 
 
-    def play_again(self):
+    async def play_again(self):
         print('Play again?')
         # Display welcome text
         self._display_text_on_screen(
             "Play again?\nPress #5 to start",
-            sleep=1,
         )
-        self.pixels.fill((0, 0, 0))
+        self.leds.fill((0, 0, 0))
         # self._led_test()
-        while True:
-            # If A button pressed (value brought low)
-            if not self.button_a.value:
-                N_DETERMINISTIC_SAMPLES = 0
-                return True
-            elif self.check_bypasses():
-                N_DETERMINISTIC_SAMPLES = 0
-                return True
-            else:
-                time.sleep(FRAME_TIME)
+        # Wait for the A button (or the bypass)
+        await self.wait_for_input("a")
+        N_DETERMINISTIC_SAMPLES = 0
+        return True
 
-    def fridge_stage(self):
+    async def fridge_stage(self):
         self._display_text_on_screen(
             "Starting BF1\n cooldown...\nV15 issue!"
         )
 
+        # If fridge connection made (value brought high)
+        if await self.wait_for_input("fridge"):
+            print('cooldown initiated')
+            self._display_text_on_screen(
+                "Valve fixed!"
+            )
+            await self.pause(5)
+
+    async def libqudev_stage(self):
+        # Both libqudev inputs are configured in pull down mode
+        decoder = PatternDecoder(LIBQUDEV_INPUTS, LIBQUDEV_MESSAGES, default=LIBQUDEV_MESSAGES["00"])
+        self.listen(*LIBQUDEV_INPUTS)
+        self.reset_events()
+        shown = None
         while True:
-            # If fridge connection made (value brought low)
-            if self.fridge_input.value:
-                print('cooldown initiated')
-                self._display_text_on_screen(
-                    "Valve fixed!"
-                )
-                time.sleep(5)
+            # All inputs from the same sampling pass
+            code, message = decoder.decode(self.inputs.snapshot())
+            # Only redraw when the pattern changed
+            if code != shown:
+                self.telemetry.text("libqudev", code)
+                self._display_text_on_screen(message)
+                shown = code
+            if code == LIBQUDEV_SUCCESS:
                 return
             # bypass If A and B pressed (brought low)
-            elif self.check_bypasses():
-                return
-            else:
-                time.sleep(FRAME_TIME)
-
-    def libqudev_stage(self):
-        self._display_text_on_screen(
-            "Choose correct\ndesign cell(s)!"
-        )
-
-        while True:
-            # both need to be configured in pull down mode
-            # If 11 returned by libqudev (value brought low)
-            if self.libqudev01_input.value and self.libqudev02_input.value:
-                self._display_text_on_screen(
-                    "Success, you\nmastered\nlibqudev!"
-                )
-                return
-            if self.libqudev01_input.value and not self.libqudev02_input.value:
-                self._display_text_on_screen(
-                    "Error: string\ncontains illegal\ncharacters"
-                )
-            if not self.libqudev01_input.value and self.libqudev02_input.value:
-                self._display_text_on_screen(
-                    "Error: dupplicate\ncell name"
-                )
-            if not self.libqudev01_input.value and not self.libqudev02_input.value:
-                print('value returned: 00 (no input)')
-                self._display_text_on_screen(
-                    "Choose correct\ndesign cell(s)!"
-                )
-            # bypass If A and B pressed (brought low)
-            elif self.check_bypasses():
+            if self.check_bypasses():
                 return
-            else:
-
-                time.sleep(FRAME_TIME)
-            print(self.libqudev01_input.value, self.libqudev02_input.value)
-            time.sleep(1)
-
+            # Any input change wakes us up, within one debounce window
+            await self.next_event()
 
-    def finish_stage(self):
+    async def finish_stage(self):
         self._display_text_on_screen(
-            "You made it!\nMove to\ntreasure", sleep=10
+            "You made it!\nMove to\ntreasure"
         )
+        await self.pause(10)
         self._display_text_on_screen("Code hint:\nQudev Sola #")
         print('Game over.')
+        print(f'Font cache: {self.fonts.stats()}')
+        print(f'Screen cache: {self.screens.stats()}')
 
 
         #
         # return False  # Unsuccessful display
-    def check_buttons(self, button_action_mapping=None, bypass_value="exit"):
-        if button_action_mapping is None:
-            button_action_mapping = [(self.button_r, 'next'), (self.button_l, 'prev')]
-        for b, action in button_action_mapping:
-            if not b.value:
-                return action
-        if self.check_bypasses():
-            return bypass_value
-
     def check_bypasses(self, button_bypass=True, software_bypass=False):
-        if button_bypass and not self.button_a.value and not self.button_b.value:
-            print('button bypass activated!')
+        if button_bypass and self.inputs.is_active("a") and self.inputs.is_active("b"):
+            self.telemetry.text("bypass", "button")
             return True
         elif software_bypass and self.software_bypass:
             print('software bypass will be activated in 2 sec!')
-            time.sleep(2)
+            self.clock.sleep(2)
             return True
         else:
             return False
 
+    def attach_loop(self, loop):
+        """
+        Forward input events to an asyncio event loop, stages then await
+        next_event() / wait_for_input() / pause() instead of sleeping.
+        """
+        self.loop = loop
+        self.events = asyncio.Queue()
+        self.bypass = asyncio.Event()
+        # Called from the input sampling thread by _forward_event(), the
+        # inputs may still be created in the background
+        self._listener = lambda event: loop.call_soon_threadsafe(self._dispatch_event, event)
+
+    def detach_loop(self):
+        """Stop forwarding input events, before the loop is closed."""
+        self._listener = None
+
+    def _forward_event(self, event):
+        # Input sampling thread, the loop may be attached or detached meanwhile
+        listener = self._listener
+        if listener is not None:
+            listener(event)
+
+    def _dispatch_event(self, event):
+        self.telemetry.text(f"input.{event.kind}", event.name)
+        self.sola.on_event(event)
+        self.events.put_nowait(event)
+        # Bypass detection: A and B held together
+        if self.inputs.is_active("a") and self.inputs.is_active("b"):
+            self.bypass.set()
+
+    def listen(self, *names):
+        """
+        Sample only these inputs and the bypass buttons, the other inputs
+        are not read until a stage listens to them.
+        """
+        self.inputs.listen(BYPASS_INPUTS + names)
+
+    def reset_events(self):
+        """Drop pending input events and bypass, e.g. when a stage starts."""
+        while not self.events.empty():
+            self.events.get_nowait()
+        self.bypass.clear()
+
+    async def next_event(self, timeout=None):
+        """
+        Next input event.
+        :param timeout: seconds to wait, None waits until an event arrives
+        :return: InputEvent, or None on timeout
+        """
+        try:
+            return await asyncio.wait_for(self.events.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def pause(self, seconds):
+        """
+        Sleep without blocking the other tasks, ends early on the bypass.
+        :return: True if interrupted by the bypass
+        """
+        with metrics.timer("pause_seconds"):
+            try:
+                await asyncio.wait_for(self.bypass.wait(), self.clock.real(seconds))
+                return True
+            except asyncio.TimeoutError:
+                return False
+
+    async def wait_for_input(self, name, timeout=None, also=()):
+        """
+        Wait until an input is active (debounced), without polling.
+        :param name: input name, see self.inputs
+        :param timeout: seconds, None waits forever
+        :param also: more inputs to sample meanwhile, for their events
+        :return: True if the input became active, False on bypass or timeout
+        """
+        self.listen(name, *also)
+        deadline = None if timeout is None else self.clock.monotonic() + timeout
+        while not self.inputs.is_active(name):
+            # bypass If A and B pressed (brought low)
+            if self.check_bypasses():
+                return False
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - self.clock.monotonic()
+                if remaining <= 0:
+                    return False
+                remaining = self.clock.real(remaining)
+            # Any input event wakes us up to check again
+            await self.next_event(timeout=remaining)
+        return True
+
     def light_neopixels(self, mask, colors, indices=None, keys=None):
         """
         :param mask: list of booleans, if True, turn on pixel, if False, turn off
@@ -688,17 +830,17 @@ class PhDHat:
         if keys is not None:
             for k, m, c in zip(keys, mask, colors):
                 if m:
-                    self.pixels[self.led_indices[k]] = c  # Turn on NeoPixel
+                    self.leds.set(self.led_indices[k], c)  # Turn on NeoPixel
                 else:
-                    self.pixels[self.led_indices[k]] = (0, 0, 0)  # Turn off NeoPixel
+                    self.leds.set(self.led_indices[k], (0, 0, 0))  # Turn off NeoPixel
         else:
             if indices is None:
-                indices = np.arange(len(mask))
+                indices = range(len(mask))
             for i, m, c in zip(indices, mask, colors):
                 if m:
-                    self.pixels[i] = c  # Turn on NeoPixel
+                    self.leds.set(i, c)  # Turn on NeoPixel
                 else:
-                    self.pixels[i] = (0, 0, 0)  # Turn off NeoPixel
+                    self.leds.set(i, (0, 0, 0))  # Turn off NeoPixel
 
     # def display_logical_operator_prompt(self, op="Z"):
     #     txt = f"Flip {op}_L?\n(Up/Down: Yes/No)"
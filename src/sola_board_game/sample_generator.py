@@ -0,0 +1,164 @@
+"""
+Generate surface code samples for the game.
+
+Simulates memory experiments of the distance-d rotated surface code in the Z
+basis with a phenomenological noise model: before each round every data
+qubit gets an X and a Z error with probabilities p_x and p_z, and every
+stabilizer measurement (and the final data qubit readout) is flipped with
+probability p_meas. Each sample stores, like samples.npz:
+- 'syndromes': detection events of every round (measurement XOR previous
+  measurement), Z stabilizers first then X stabilizers
+- 'data_qubits': final Z readout of the data qubits
+- 'log_op': logical Z measured from the data qubits
+- 'log_op_init': prepared logical state
+
+Samples are simulated in chunks on a process pool and streamed to a sample
+store. Every chunk has its own random stream spawned from the seed, so the
+output only depends on the seed and chunk size, not on the number of workers.
+
+    python sample_generator.py samples.sst --distance 3 --rounds 6 --samples 100000
+"""
+import argparse
+from collections import namedtuple
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from sample_store import SampleWriter
+
+NoiseModel = namedtuple("NoiseModel", ["p_x", "p_z", "p_meas"])
+
+
+class RotatedSurfaceCode:
+    """
+    Check matrices of the distance-d rotated surface code. Data qubit
+    (row, col) has index row * d + col. Faces of the d x d grid alternate X
+    and Z type, weight-2 X faces are kept on the top/bottom boundaries and
+    weight-2 Z faces on the left/right boundaries.
+
+    The stabilizers are in the order of samples.npz: X faces row by row and
+    Z faces column by column (for d=3, Z on qubits 0 3, 3 4 6 7, 1 2 4 5 and
+    5 8), so that the aux bits of the syndromes match the shipped samples.
+    """
+
+    def __init__(self, distance):
+        d = distance
+        self.distance = d
+        self.n_data_qbs = d * d
+        faces = [(row, col) for row in range(-1, d) for col in range(-1, d)]
+        stabilizers = {"X": [], "Z": []}
+        for kind, order in (("X", faces), ("Z", sorted(faces, key=lambda face: (face[1], face[0])))):
+            for row, col in order:
+                if kind != ("X" if (row + col) % 2 == 0 else "Z"):
+                    continue
+                qubits = [r * d + c for r in (row, row + 1) for c in (col, col + 1)
+                          if 0 <= r < d and 0 <= c < d]
+                if len(qubits) == 4 \
+                        or (len(qubits) == 2 and kind == "X" and row in (-1, d - 1)) \
+                        or (len(qubits) == 2 and kind == "Z" and col in (-1, d - 1)):
+                    support = np.zeros(self.n_data_qbs, dtype=np.uint8)
+                    support[qubits] = 1
+                    stabilizers[kind].append(support)
+        self.h_x = np.array(stabilizers["X"])
+        self.h_z = np.array(stabilizers["Z"])
+        self.n_aux_qbs = len(self.h_x) + len(self.h_z)
+
+        # Logical operators: the row/column commuting with the other type
+        lines = [np.isin(np.arange(d * d), [i * d + j for j in range(d)]) for i in range(d)] \
+            + [np.isin(np.arange(d * d), [j * d + i for j in range(d)]) for i in range(d)]
+        self.z_logical = next(line for line in lines if not (self.h_x @ line % 2).any()).astype(np.uint8)
+        self.x_logical = next(line for line in lines if not (self.h_z @ line % 2).any()).astype(np.uint8)
+
+
+def simulate(code, noise, n_rounds, n_samples, rng, log_op_init=1):
+    """
+    Vectorised over samples, see the module docstring.
+    :param log_op_init: prepared logical state, None for random
+    :return: syndromes (n_samples, n_rounds * n_aux_qbs), data_qubits
+    (n_samples, n_data_qbs), log_op (n_samples,), log_op_init (n_samples,)
+    """
+    n_data = code.n_data_qbs
+    # Pauli frame of the accumulated errors
+    x = np.zeros((n_samples, n_data), dtype=np.uint8)
+    z = np.zeros((n_samples, n_data), dtype=np.uint8)
+    previous = np.zeros((n_samples, code.n_aux_qbs), dtype=np.uint8)
+    syndromes = np.empty((n_samples, n_rounds, code.n_aux_qbs), dtype=np.uint8)
+    for r in range(n_rounds):
+        x ^= rng.random((n_samples, n_data)) < noise.p_x
+        z ^= rng.random((n_samples, n_data)) < noise.p_z
+        # X errors flip Z stabilizers and Z errors flip X stabilizers
+        measured = np.concatenate([x @ code.h_z.T % 2, z @ code.h_x.T % 2], axis=1).astype(np.uint8)
+        measured ^= rng.random(measured.shape) < noise.p_meas
+        syndromes[:, r] = measured ^ previous
+        previous = measured
+
+    if log_op_init is None:
+        init = rng.integers(0, 2, n_samples, dtype=np.uint8)
+    else:
+        init = np.full(n_samples, log_op_init, dtype=np.uint8)
+    # The code state measured in the Z basis gives a random product of X
+    # stabilizers, times X_L for the logical 1
+    stabilizers = rng.integers(0, 2, (n_samples, len(code.h_x)), dtype=np.uint8)
+    data = (stabilizers @ code.h_x % 2).astype(np.uint8)
+    data ^= init[:, None] * code.x_logical
+    data ^= x
+    data ^= rng.random(data.shape) < noise.p_meas
+    log_op = data @ code.z_logical % 2
+    return syndromes.reshape(n_samples, -1), data, log_op, init
+
+
+def _simulate_chunk(args):
+    distance, noise, n_rounds, n_samples, seed, log_op_init = args
+    rng = np.random.default_rng(seed)
+    return simulate(RotatedSurfaceCode(distance), noise, n_rounds, n_samples, rng, log_op_init)
+
+
+def generate(path, distance, n_rounds, n_samples, noise, seed=0, chunk_size=10000,
+             workers=None, log_op_init=1):
+    """
+    Simulate ``n_samples`` samples on a process pool and write them to a
+    sample store at ``path``.
+    :param workers: processes, all cores by default
+    """
+    code = RotatedSurfaceCode(distance)
+    sizes = [min(chunk_size, n_samples - start) for start in range(0, n_samples, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(distance, noise, n_rounds, size, s, log_op_init) for size, s in zip(sizes, seeds)]
+    with SampleWriter(path, code.n_aux_qbs, code.n_data_qbs) as writer, \
+            multiprocessing.Pool(workers or os.cpu_count()) as pool:
+        # Chunks come back in order, the file does not depend on the timing
+        for chunk in pool.imap(_simulate_chunk, tasks):
+            writer.add_many(*chunk)
+    return code
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate surface code samples")
+    parser.add_argument("path", help="output sample store")
+    parser.add_argument("--distance", type=int, default=3)
+    parser.add_argument("--rounds", type=int, default=6)
+    parser.add_argument("--samples", type=int, default=1000)
+    parser.add_argument("--p-x", type=float, default=0.02, help="X error probability per round")
+    parser.add_argument("--p-z", type=float, default=0.02, help="Z error probability per round")
+    parser.add_argument("--p-meas", type=float, default=0.02, help="measurement error probability")
+    parser.add_argument("--log-op-init", type=int, choices=[0, 1], default=1,
+                        help="prepared logical state, random if the flag has no value", nargs="?")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--workers", type=int, help="processes, all cores by default")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    generate(
+        args.path, args.distance, args.rounds, args.samples,
+        NoiseModel(args.p_x, args.p_z, args.p_meas),
+        seed=args.seed, chunk_size=args.chunk_size, workers=args.workers,
+        log_op_init=args.log_op_init,
+    )
+    print(f"{args.samples} samples written to {args.path} in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
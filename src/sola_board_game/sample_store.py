@@ -0,0 +1,231 @@
+"""
+Columnar, memory-mapped store of surface code samples.
+
+A sample is the syndrome bits of all rounds, the final data qubit bits and
+the logical operator. All samples are kept in one file:
+
+    magic, header length, JSON header    padded to HEADER_SIZE bytes
+    syndromes         uint8 (n_rounds_total, packed_width), bit-packed
+                      rounds of all samples back to back, see syndromes.py
+    round_offsets     int64 (n_samples + 1,), the rounds of sample i are
+                      syndromes[offsets[i]:offsets[i + 1]]
+    data_qubits       uint8 0/1 (n_samples, n_data_qbs)
+    log_op            int8 (n_samples,)
+    log_op_init       int8 (n_samples,)
+
+The header gives the offset, dtype and shape of each column. Opening the
+store only maps the file, samples are read from disk when they are accessed.
+Packed syndromes and data qubits are returned as views, without copies.
+
+Convert a pickled npz of samples with
+    python sample_store.py samples.npz samples.sst
+"""
+import json
+import os
+import struct
+import sys
+from array import array
+
+import numpy as np
+
+from syndromes import pack_rounds, packed_width, unpack_rounds
+
+MAGIC = b"SOLASMPL"
+VERSION = 2
+# Room for the JSON header, columns start after it
+HEADER_SIZE = 4096
+# Column alignment in the file
+ALIGN = 64
+
+
+class SampleWriter:
+    """
+    Writes a sample store one sample at a time, so that large libraries are
+    never held in memory. Packed syndromes are streamed to the file, the
+    small per-sample columns are written by close().
+    """
+
+    def __init__(self, path, n_aux_qbs, n_data_qbs):
+        self.path = path
+        self.n_aux_qbs = n_aux_qbs
+        self.n_data_qbs = n_data_qbs
+        self.n_samples = 0
+        self._offsets = array("q", [0])
+        self._data_qubits = bytearray()
+        self._log_op = array("b")
+        self._log_op_init = array("b")
+
+        self._file = open(path, "wb")
+        self._file.write(bytes(HEADER_SIZE))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            os.remove(self.path)
+        return False
+
+    def add(self, syndromes, data_qubits, log_op, log_op_init=0):
+        """
+        :param syndromes: syndrome bits of all rounds, round after round
+        :param data_qubits: n_data_qbs bits
+        """
+        syndromes = np.asarray(syndromes, dtype=np.uint8)
+        data_qubits = np.asarray(data_qubits, dtype=np.uint8)
+        if len(syndromes) % self.n_aux_qbs:
+            raise ValueError(f"{len(syndromes)} syndrome bits is not a whole number of rounds")
+        if len(data_qubits) != self.n_data_qbs:
+            raise ValueError(f"expected {self.n_data_qbs} data qubits, got {len(data_qubits)}")
+        self._file.write(pack_rounds(syndromes, self.n_aux_qbs).tobytes())
+        self._offsets.append(self._offsets[-1] + len(syndromes) // self.n_aux_qbs)
+        self._data_qubits += data_qubits.tobytes()
+        self._log_op.append(int(log_op))
+        self._log_op_init.append(int(log_op_init))
+        self.n_samples += 1
+
+    def add_many(self, syndromes, data_qubits, log_op, log_op_init):
+        """
+        Add samples with the same number of rounds at once.
+        :param syndromes: (n, n_rounds * n_aux_qbs) syndrome bits
+        :param data_qubits: (n, n_data_qbs) bits
+        :param log_op: (n,)
+        :param log_op_init: (n,)
+        """
+        syndromes = np.asarray(syndromes, dtype=np.uint8)
+        data_qubits = np.asarray(data_qubits, dtype=np.uint8)
+        n, n_bits = syndromes.shape
+        if n_bits % self.n_aux_qbs:
+            raise ValueError(f"{n_bits} syndrome bits is not a whole number of rounds")
+        if data_qubits.shape != (n, self.n_data_qbs):
+            raise ValueError(f"expected {n} x {self.n_data_qbs} data qubits, got {data_qubits.shape}")
+        n_rounds = n_bits // self.n_aux_qbs
+        self._file.write(pack_rounds(syndromes, self.n_aux_qbs).tobytes())
+        last = self._offsets[-1]
+        self._offsets.extend(range(last + n_rounds, last + (n + 1) * n_rounds, n_rounds))
+        self._data_qubits += data_qubits.tobytes()
+        self._log_op.extend(np.asarray(log_op, dtype=np.int8).tolist())
+        self._log_op_init.extend(np.asarray(log_op_init, dtype=np.int8).tolist())
+        self.n_samples += n
+
+    def _write_column(self, data, dtype, shape):
+        pos = self._file.tell()
+        pad = -pos % ALIGN
+        self._file.write(bytes(pad))
+        self._file.write(data)
+        return {"offset": pos + pad, "dtype": dtype, "shape": shape}
+
+    def close(self):
+        n = self.n_samples
+        columns = {
+            "syndromes": {"offset": HEADER_SIZE, "dtype": "u1",
+                          "shape": [self._offsets[-1], packed_width(self.n_aux_qbs)]},
+            "round_offsets": self._write_column(self._offsets.tobytes(), "<i8", [n + 1]),
+            "data_qubits": self._write_column(bytes(self._data_qubits), "u1", [n, self.n_data_qbs]),
+            "log_op": self._write_column(self._log_op.tobytes(), "i1", [n]),
+            "log_op_init": self._write_column(self._log_op_init.tobytes(), "i1", [n]),
+        }
+        header = json.dumps({
+            "version": VERSION,
+            "n_samples": n,
+            "n_aux_qbs": self.n_aux_qbs,
+            "n_data_qbs": self.n_data_qbs,
+            "columns": columns,
+        }).encode()
+        if len(MAGIC) + 4 + len(header) > HEADER_SIZE:
+            raise ValueError("sample store header too large")
+        self._file.seek(0)
+        self._file.write(MAGIC + struct.pack("<I", len(header)) + header)
+        self._file.close()
+
+
+class SampleStore:
+    """
+    Read-only view of a sample store file.
+
+    ``store[i]`` is a dict with the same keys as the samples of the npz
+    files: 'syndromes' (flat bool array), 'data_qubits' (bool array, view of
+    the file), 'log_op' and 'log_op_init' (ints), plus 'packed_syndromes'
+    (packed rounds, view of the file) and 'index'.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._mm = np.memmap(path, dtype=np.uint8, mode="r")
+        if bytes(self._mm[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a sample store")
+        (length,) = struct.unpack("<I", bytes(self._mm[len(MAGIC):len(MAGIC) + 4]))
+        start = len(MAGIC) + 4
+        self.header = json.loads(bytes(self._mm[start:start + length]))
+        if self.header["version"] != VERSION:
+            raise ValueError(f"unsupported sample store version {self.header['version']}")
+
+        self.n_aux_qbs = self.header["n_aux_qbs"]
+        self.n_data_qbs = self.header["n_data_qbs"]
+        self.syndromes = self._column("syndromes")
+        self.round_offsets = self._column("round_offsets")
+        self.data_qubits = self._column("data_qubits").view(bool)
+        self.log_op = self._column("log_op")
+        self.log_op_init = self._column("log_op_init")
+
+    def _column(self, name):
+        column = self.header["columns"][name]
+        dtype = np.dtype(column["dtype"])
+        count = int(np.prod(column["shape"]))
+        offset = column["offset"]
+        return self._mm[offset:offset + count * dtype.itemsize].view(dtype).reshape(column["shape"])
+
+    def __len__(self):
+        return self.header["n_samples"]
+
+    def __getitem__(self, index):
+        if not -len(self) <= index < len(self):
+            raise IndexError(f"sample {index} out of range")
+        index %= len(self)
+        packed = self.packed_rounds(index)
+        return {
+            "index": index,
+            "syndromes": unpack_rounds(packed, self.n_aux_qbs).reshape(-1),
+            "packed_syndromes": packed,
+            "data_qubits": self.data_qubits[index],
+            "log_op": int(self.log_op[index]),
+            "log_op_init": int(self.log_op_init[index]),
+        }
+
+    def packed_rounds(self, index):
+        """Packed syndromes of one sample, view (n_rounds, packed_width)."""
+        return self.syndromes[self.round_offsets[index]:self.round_offsets[index + 1]]
+
+    def rounds(self, index):
+        """Syndromes of one sample, bool array (n_rounds, n_aux_qbs)."""
+        return unpack_rounds(self.packed_rounds(index), self.n_aux_qbs)
+
+
+def convert_npz(npz_path, store_path):
+    """
+    Convert a pickled npz of samples (one entry per seed, each a dict with
+    'syndromes', 'data_qubits', 'log_op' and 'log_op_init') to a sample store.
+    Samples are written in the order of the seeds.
+    """
+    data = np.load(npz_path, allow_pickle=True)
+    seeds = sorted(data.files, key=int)
+    first = data[seeds[0]].item()
+    n_data_qbs = len(first["data_qubits"])
+    # Syndromes of one round are the d**2 - 1 auxiliary qubits
+    n_aux_qbs = n_data_qbs - 1
+    with SampleWriter(store_path, n_aux_qbs, n_data_qbs) as writer:
+        for seed in seeds:
+            sample = data[seed].item()
+            writer.add(sample["syndromes"], sample["data_qubits"], sample["log_op"],
+                       sample.get("log_op_init", 0))
+    return len(seeds)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: python sample_store.py samples.npz samples.sst")
+    n = convert_npz(sys.argv[1], sys.argv[2])
+    print(f"Converted {n} samples to {sys.argv[2]}")
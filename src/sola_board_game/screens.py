@@ -0,0 +1,128 @@
+"""
+Cache of pre-rendered static screens, in SSD1306 page order, so that showing
+one is a copy and a display transfer without drawing any text.
+
+The cache file is
+
+    magic, uint16 signature length, signature (display size, font...)
+    then for each screen: uint16 text length, utf-8 text, pages * width bytes
+
+Screens are appended when first rendered. A file with another signature is
+discarded, an interrupted append is cut off on load. The file is in the user
+cache directory ($XDG_CACHE_HOME/sola_board_game, ~/.cache by default).
+Build it ahead of the first boot with
+
+    python screens.py
+"""
+import os
+import struct
+
+MAGIC = b"SOLASCRN"
+LENGTH = struct.Struct("<H")
+
+
+def cache_dir():
+    """Writable directory for the caches of the game."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "sola_board_game")
+
+
+class ScreenCache:
+    """
+    :param path: cache file, None keeps the screens in memory only
+    :param frame_size: bytes of a screen, pages * width
+    :param signature: what the screens depend on, e.g. display size and font
+    """
+
+    def __init__(self, path, frame_size, signature):
+        self.path = path
+        self.frame_size = frame_size
+        self.signature = signature
+        # text: frame bytes
+        self.screens = {}
+        self.hits = 0
+        self.misses = 0
+        if path is not None:
+            self._load()
+
+    def _header(self):
+        encoded = self.signature.encode()
+        return MAGIC + LENGTH.pack(len(encoded)) + encoded
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            data = f.read()
+        header = self._header()
+        if not data.startswith(header):
+            print(f"Discarding screen cache {self.path}, made for another display or font")
+            os.remove(self.path)
+            return
+        pos = len(header)
+        while pos + LENGTH.size <= len(data):
+            (length,) = LENGTH.unpack_from(data, pos)
+            end = pos + LENGTH.size + length + self.frame_size
+            if end > len(data):
+                # Interrupted append, the screen is rendered again
+                break
+            text = data[pos + LENGTH.size:pos + LENGTH.size + length].decode()
+            self.screens[text] = data[end - self.frame_size:end]
+            pos = end
+        if pos < len(data):
+            # Cut the interrupted append off, the next one starts at a record
+            with open(self.path, "r+b") as f:
+                f.truncate(pos)
+
+    def get(self, text):
+        """:return: frame bytes, None if the screen is not cached"""
+        frame = self.screens.get(text)
+        if frame is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return frame
+
+    def add(self, text, frame):
+        if len(frame) != self.frame_size:
+            raise ValueError(f"Expected {self.frame_size} bytes, got {len(frame)}")
+        self.screens[text] = bytes(frame)
+        if self.path is None:
+            return
+        new_file = not os.path.exists(self.path)
+        encoded = text.encode()
+        try:
+            if new_file:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "ab") as f:
+                if new_file:
+                    f.write(self._header())
+                f.write(LENGTH.pack(len(encoded)) + encoded + frame)
+        except OSError as e:
+            print(f"Keeping the screens in memory, cannot write {self.path}: {e}")
+            self.path = None
+
+    def stats(self):
+        return {"screens": len(self.screens), "hits": self.hits, "misses": self.misses}
+
+
+def main():
+    import argparse
+
+    import phdhat
+    from simulation import SimBackend
+
+    parser = argparse.ArgumentParser(description="Render the static screens of the game to the cache")
+    parser.add_argument("--path", default=phdhat.SCREEN_CACHE, help="cache file")
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        os.remove(args.path)
+    hat = phdhat.PhDHat(backend=SimBackend(), screen_cache=args.path)
+    for text in phdhat.STATIC_SCREENS:
+        hat._display_text_on_screen(text)
+    print(f"{len(hat.screens.screens)} screens saved to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+Simulated devices of the PhD hat, see backends.py.
+"""
+import json
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from backends import Clock, PULL_UP
+from display import SET_COL_ADDR, SET_PAGE_ADDR, PAGE_HEIGHT
+
+
+class SimPin:
+    """Digital input whose level is driven by a script."""
+
+    def __init__(self, pull=PULL_UP):
+        self.pull = pull
+        # None follows the pull resistor, True/False forces the level
+        self.level = None
+
+    @property
+    def value(self):
+        if self.level is None:
+            return self.pull == PULL_UP
+        return self.level
+
+
+class SimI2CDevice:
+    """Receives the data transfers of SimDisplay."""
+
+    def __init__(self, display):
+        self.display = display
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def write(self, data):
+        self.display.write_data(data[1:])
+
+
+class SimDisplay:
+    """
+    SSD1306 emulation in horizontal addressing mode.
+
+    Commands and data are applied to an emulated display RAM, and each data
+    transfer records a frame (``frames``: list of (time, bool array of shape
+    (height, width))). Frames are also saved as PNG files if ``frame_dir`` is
+    set.
+    """
+
+    def __init__(self, width, height, frame_dir=None, keep_frames=True):
+        self.width = width
+        self.height = height
+        self.pages = height // PAGE_HEIGHT
+        # Same layout as the adafruit driver: I2C control byte + page buffer
+        self.buffer = bytearray(self.pages * width + 1)
+        self.buffer[0] = 0x40
+        self.i2c_device = SimI2CDevice(self)
+
+        self.ram = np.zeros((self.pages, width), dtype=np.uint8)
+        self.window = (0, width - 1, 0, self.pages - 1)
+        self._cmd = []
+
+        self.frame_dir = frame_dir
+        if frame_dir is not None:
+            os.makedirs(frame_dir, exist_ok=True)
+        self.keep_frames = keep_frames
+        self.frames = []
+        self.n_frames = 0
+        self.bytes_written = 0
+        # (time, data bytes) of every transfer
+        self.writes = []
+
+    def image(self, img):
+        """Pack a mode "1" image into self.buffer (SSD1306 page order)."""
+        bits = np.asarray(img.convert("1"), dtype=np.uint8).reshape(self.pages, PAGE_HEIGHT, self.width)
+        self.buffer[1:] = np.packbits(bits, axis=1, bitorder="little").tobytes()
+
+    def fill(self, color):
+        self.buffer[1:] = bytes([0xFF if color else 0]) * (len(self.buffer) - 1)
+
+    def show(self):
+        self.window = (0, self.width - 1, 0, self.pages - 1)
+        self.write_data(self.buffer[1:])
+
+    def write_cmd(self, cmd):
+        # Address commands take two arguments
+        if self._cmd or cmd in (SET_COL_ADDR, SET_PAGE_ADDR):
+            self._cmd.append(cmd)
+        if len(self._cmd) == 3:
+            kind, start, end = self._cmd
+            col0, col1, page0, page1 = self.window
+            if kind == SET_COL_ADDR:
+                self.window = (start, end, page0, page1)
+            else:
+                self.window = (col0, col1, start, end)
+            self._cmd = []
+
+    def write_data(self, data):
+        col0, col1, page0, page1 = self.window
+        n_cols = col1 - col0 + 1
+        data = np.frombuffer(bytes(data), dtype=np.uint8)
+        for page in range(page0, page1 + 1):
+            row = data[(page - page0) * n_cols:(page - page0 + 1) * n_cols]
+            self.ram[page, col0:col0 + len(row)] = row
+        self.bytes_written += len(data)
+        self.writes.append((time.monotonic(), len(data)))
+        self.record_frame()
+
+    def frame(self):
+        """Current panel content, bool array of shape (height, width)."""
+        bits = np.unpackbits(self.ram[:, None, :], axis=1, bitorder="little")
+        return bits.reshape(self.height, self.width).astype(bool)
+
+    def record_frame(self):
+        frame = self.frame()
+        if self.keep_frames:
+            self.frames.append((time.monotonic(), frame))
+        if self.frame_dir is not None:
+            Image.fromarray(frame).save(os.path.join(self.frame_dir, f"frame_{self.n_frames:05d}.png"))
+        self.n_frames += 1
+
+
+class SimPixels(list):
+    """NeoPixel strip recording every show() in ``history``."""
+
+    def __init__(self, count, pixel_order="GRBW", brightness=1.0):
+        self.bpp = len(pixel_order)
+        super().__init__([(0,) * self.bpp] * count)
+        self.brightness = brightness
+        self.shows = 0
+        self.history = []
+
+    def fill(self, color):
+        for idx in range(len(self)):
+            self[idx] = color
+
+    def show(self):
+        self.shows += 1
+        self.history.append((time.monotonic(), tuple(self)))
+
+
+class SimDistanceSensor:
+    """HC-SR04 replacement, ``distance`` in meters is set by the script."""
+
+    def __init__(self, distance=1.0):
+        self.distance = distance
+
+
+class SimBackend:
+    """
+    Simulated devices, driven by scripted inputs.
+
+    Inputs can be addressed by pin ("D5") or by their name in the game
+    ("a"), and the distance sensor by "distance". A script is a list of
+    (time in seconds from the start of play(), target, value) entries, see
+    play() and load_script().
+
+    :param speed: > 1 runs the game faster than real time: the script, and
+    the pauses, timeouts and timers of the stages, see backends.Clock
+    """
+
+    def __init__(self, frame_dir=None, keep_frames=True, distance=1.0, speed=1.0):
+        self.clock = Clock(speed)
+        self.frame_dir = frame_dir
+        self.keep_frames = keep_frames
+        self.pins = {}
+        self.disp = None
+        self.strip = None
+        self.sensor = SimDistanceSensor(distance)
+        # (time, target, value) of the script entries applied by play()
+        self.applied = []
+        self._player = None
+
+    def pin(self, pin_name, pull=PULL_UP, name=None):
+        # Several inputs may share a pin, they then share the level
+        io = self.pins.get(pin_name) or SimPin(pull)
+        self.pins[pin_name] = io
+        if name is not None:
+            self.pins[name] = io
+        return io
+
+    def display(self, width, height):
+        self.disp = SimDisplay(width, height, frame_dir=self.frame_dir, keep_frames=self.keep_frames)
+        return self.disp
+
+    def pixels(self, pin_name, count, brightness, pixel_order):
+        self.strip = SimPixels(count, pixel_order=pixel_order, brightness=brightness)
+        return self.strip
+
+    def distance_sensor(self, echo, trigger):
+        return self.sensor
+
+    def set(self, target, value):
+        """
+        Drive an input.
+        :param target: pin or input name, or "distance"
+        :param value: level (True/False, None to release to the pull
+        resistor), or the distance in meters
+        """
+        if target == "distance":
+            self.sensor.distance = value
+        else:
+            self.pins[target].level = value
+
+    def press(self, target, duration=0.1, active_low=True):
+        """Blocking press of a button, for interactive use."""
+        self.set(target, not active_low)
+        time.sleep(duration)
+        self.set(target, None)
+
+    def play(self, script):
+        """
+        Apply a script in a background thread.
+        :param script: list of (time, target, value), times in game seconds
+        :return: the player thread
+        """
+        def run():
+            start = self.clock.monotonic()
+            for at, target, value in sorted(script, key=lambda entry: entry[0]):
+                delay = at - (self.clock.monotonic() - start)
+                if delay > 0:
+                    self.clock.sleep(delay)
+                self.set(target, value)
+                self.applied.append((time.monotonic(), target, value))
+
+        self._player = threading.Thread(target=run, name="sim-script", daemon=True)
+        self._player.start()
+        return self._player
+
+    @staticmethod
+    def load_script(path):
+        """Read a JSON script: a list of [time, target, value] entries."""
+        with open(path) as f:
+            return [tuple(entry) for entry in json.load(f)]
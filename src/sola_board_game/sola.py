@@ -0,0 +1,74 @@
+"""
+SOLA legs of the hat: the table describing each leg and the watcher timing
+their connections.
+"""
+from collections import namedtuple
+import time
+
+import metrics
+from inputs import PRESS, RELEASE
+
+# label: shown name, input: input name, pin: board pin, active_low: the leg
+# pulls the pin low when connected, debounce: s, timeout: s sola_stage waits
+# before moving on without the connection, None waits forever
+SolaLeg = namedtuple("SolaLeg", ["label", "input", "pin", "active_low", "debounce", "timeout"])
+
+metrics.define("sola_connect_seconds", "Time from the start of a SOLA leg to its connection",
+               buckets=(0.1, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300))
+
+
+class SolaWatcher:
+    """
+    Follows the connection of the SOLA legs from their input events, and
+    times how long the player took to connect the expected one. All legs are
+    sampled while one is expected (see PhDHat.sola_stage()), so connections of
+    the other legs are seen too.
+
+    :param legs: {leg: SolaLeg}
+    :param telemetry: optional Telemetry recorder of the connection times
+    :param clock: time of the input events, e.g. the game clock of the backend
+    """
+
+    def __init__(self, legs, telemetry=None, clock=time):
+        self.legs = legs
+        self.clock = clock
+        self.telemetry = telemetry
+        self._legs_by_input = {leg.input: key for key, leg in legs.items()}
+        # leg: clock.monotonic() of the connection, while connected
+        self.connected_at = {}
+        # leg: clock.monotonic() when the game started waiting for it
+        self.waiting_since = {}
+        # leg: s from waiting to connected
+        self.connection_times = {}
+
+    def on_event(self, event):
+        key = self._legs_by_input.get(event.name)
+        if key is None:
+            return
+        if event.kind == PRESS:
+            self.connected_at[key] = event.time
+        elif event.kind == RELEASE:
+            self.connected_at.pop(key, None)
+
+    def expect(self, key, now=None):
+        """The game starts waiting for a leg."""
+        self.waiting_since[key] = self.clock.monotonic() if now is None else now
+
+    def connected(self, key, now=None):
+        """
+        The expected leg is connected, record how long it took.
+        :return: s from expect() to the connection, 0 if it was already
+        connected
+        """
+        now = self.clock.monotonic() if now is None else now
+        since = self.waiting_since.pop(key, now)
+        duration = max(0.0, self.connected_at.get(key, now) - since)
+        self.connection_times[key] = duration
+        metrics.observe("sola_connect_seconds", duration, leg=self.legs[key].label)
+        if self.telemetry is not None:
+            self.telemetry.record(f"sola.{self.legs[key].input}", duration)
+        return duration
+
+    def cancel(self, key):
+        """The game stopped waiting for a leg without its connection."""
+        self.waiting_since.pop(key, None)
@@ -0,0 +1,46 @@
+"""
+Bit-packed syndromes of the surface code.
+
+A round of syndromes (one bit per auxiliary qubit) is packed in
+ceil(n_aux_qbs / 8) bytes, auxiliary qubit i being bit i % 8 of byte i // 8.
+A sample is then a (n_rounds, n_bytes) uint8 array, and turning rounds into
+NeoPixel colours is a single numpy operation on all of them.
+"""
+import numpy as np
+
+BITORDER = "little"
+OFF = (0, 0, 0)
+
+
+def packed_width(n_aux_qbs):
+    """Bytes per packed round."""
+    return (n_aux_qbs + 7) // 8
+
+
+def pack_rounds(syndromes, n_aux_qbs):
+    """
+    :param syndromes: flat syndrome bits, round after round
+    :return: uint8 array (n_rounds, packed_width(n_aux_qbs))
+    """
+    bits = np.asarray(syndromes, dtype=np.uint8).reshape(-1, n_aux_qbs)
+    return np.packbits(bits, axis=1, bitorder=BITORDER)
+
+
+def unpack_rounds(packed, n_aux_qbs):
+    """Inverse of pack_rounds, bool array (..., n_aux_qbs)."""
+    return np.unpackbits(packed, axis=-1, count=n_aux_qbs, bitorder=BITORDER).view(bool)
+
+
+def rounds_to_colors(packed, colors, n_aux_qbs, off=OFF):
+    """
+    Colour frames of packed rounds, the colour of each auxiliary qubit where
+    its syndrome bit is set and ``off`` elsewhere.
+    :param packed: (..., packed_width) packed rounds, e.g. all rounds of a
+    sample or a single round
+    :param colors: (n_aux_qbs, bpp) colour of each auxiliary qubit
+    :return: uint8 array (..., n_aux_qbs, bpp)
+    """
+    colors = np.asarray(colors, dtype=np.uint8)
+    off = np.asarray(off, dtype=np.uint8)
+    bits = unpack_rounds(packed, n_aux_qbs)
+    return np.where(bits[..., None], colors, off)
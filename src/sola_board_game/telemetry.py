@@ -0,0 +1,271 @@
+"""
+Low overhead telemetry: fixed-size binary records (timestamp, source, value)
+written to a preallocated ring buffer and flushed to a log file by a
+background thread.
+
+Sources and text values are interned: a record only holds their id, names
+are written once to the log as definitions. The log is a sequence of blocks
+
+    uint32 number of definitions, then for each: uint8 kind (SOURCE,
+    TEXT_SOURCE or TEXT), uint16 id, uint16 length, utf-8 name
+    uint32 number of records, then the records (RECORD)
+
+Every session appended to the log starts with a header block
+
+    uint32 SESSION, time.time() and time.monotonic() at the start (SESSION_BASE)
+
+Ids are only valid within their session, and the monotonic times of a
+session are converted to wall clock times with its base, so that sessions
+from different boots are read in order.
+
+Read a session with
+    python telemetry.py telemetry.bin             # per stage timings
+    python telemetry.py telemetry.bin --trace     # all records
+"""
+import argparse
+from collections import defaultdict
+import os
+import struct
+import threading
+import time
+
+# time.monotonic(), source id, value
+RECORD = struct.Struct("<dHd")
+COUNT = struct.Struct("<I")
+DEFINITION = struct.Struct("<BHH")
+# Number of definitions marking a session header, never a real count
+SESSION = 0xFFFFFFFF
+# Wall clock and monotonic time of the session start
+SESSION_BASE = struct.Struct("<dd")
+# Definition kinds, the values of a TEXT_SOURCE are TEXT ids
+SOURCE = 0
+TEXT_SOURCE = 1
+TEXT = 2
+# Texts interned beyond this are recorded as OVERFLOW_TEXT, so that a
+# source of ever changing messages cannot grow the table without bound
+MAX_TEXTS = 4096
+OVERFLOW_TEXT = "<too many texts>"
+
+STAGE_START = "stage.start"
+STAGE_END = "stage.end"
+
+
+class Telemetry:
+    """
+    :param path: log file, None keeps the records in memory only
+    :param capacity: records in the ring buffer. Records not flushed before
+    the buffer wraps around are lost and counted in ``dropped``.
+    :param echo: also print text records, for debugging
+    """
+
+    def __init__(self, path=None, capacity=65536, flush_period=0.5, echo=False):
+        self.path = path
+        self.capacity = capacity
+        self.flush_period = flush_period
+        self.echo = echo
+
+        self.buffer = bytearray(capacity * RECORD.size)
+        # Number of records written and flushed since the start
+        self.written = 0
+        self.flushed = 0
+        self.dropped = 0
+
+        self.sources = {}
+        self.texts = {}
+        self.session_base = (time.time(), time.monotonic())
+        self._header_written = False
+        # Definitions not written to the log yet
+        self._new_definitions = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    def _intern(self, table, kind, name):
+        ident = table.get(name)
+        if ident is None:
+            if kind == TEXT and len(table) >= MAX_TEXTS and name != OVERFLOW_TEXT:
+                return self._intern(table, kind, OVERFLOW_TEXT)
+            ident = table[name] = len(table)
+            self._new_definitions.append((kind, ident, name))
+        return ident
+
+    def record(self, source, value=0.0):
+        """Record a number, e.g. a sensor reading."""
+        now = time.monotonic()
+        with self._lock:
+            ident = self._intern(self.sources, SOURCE, source)
+            RECORD.pack_into(self.buffer, (self.written % self.capacity) * RECORD.size, now, ident, value)
+            self.written += 1
+
+    def text(self, source, message):
+        """Record a message, its value is the id of the interned text."""
+        if self.echo:
+            print(f"{source}: {message}")
+        now = time.monotonic()
+        with self._lock:
+            ident = self._intern(self.sources, TEXT_SOURCE, source)
+            value = self._intern(self.texts, TEXT, message)
+            RECORD.pack_into(self.buffer, (self.written % self.capacity) * RECORD.size, now, ident, value)
+            self.written += 1
+
+    def flush(self):
+        """Append the new records to the log file."""
+        with self._flush_lock:
+            with self._lock:
+                written = self.written
+                definitions = self._new_definitions
+                self._new_definitions = []
+                start = self.flushed
+                if written - start > self.capacity:
+                    self.dropped += written - start - self.capacity
+                    start = written - self.capacity
+                # Copy under the lock, writers may wrap around meanwhile. The
+                # new records are at most two slices of the ring.
+                first = start % self.capacity
+                count = min(written - start, self.capacity - first)
+                chunks = [bytes(self.buffer[first * RECORD.size:(first + count) * RECORD.size]),
+                          bytes(self.buffer[:(written - start - count) * RECORD.size])]
+                self.flushed = written
+
+            if self.path is None or (not definitions and written == start):
+                return
+            block = bytearray()
+            if not self._header_written:
+                block += COUNT.pack(SESSION) + SESSION_BASE.pack(*self.session_base)
+                self._header_written = True
+            block += COUNT.pack(len(definitions))
+            for kind, ident, name in definitions:
+                encoded = name.encode()
+                block += DEFINITION.pack(kind, ident, len(encoded)) + encoded
+            block += COUNT.pack(written - start)
+            for chunk in chunks:
+                block += chunk
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(self.path, "ab") as f:
+                    f.write(block)
+            except OSError as e:
+                # e.g. a read-only or full disk, the game goes on without it
+                print(f"Keeping the telemetry in memory, cannot write {self.path}: {e}")
+                self.path = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while self._running:
+            time.sleep(self.flush_period)
+            self.flush()
+
+
+def read_log(path):
+    """
+    :return: sources {id: name} and texts {id: text} of the last session,
+    records [(time, source name, value)] of all sessions, the value of a
+    text record being the text. Times are wall clock times, monotonic ones
+    for a log written without session headers.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    sources = {}
+    text_sources = set()
+    texts = {}
+    records = []
+    # Added to the monotonic times of the session
+    offset = 0.0
+    pos = 0
+    while pos < len(data):
+        (n_definitions,) = COUNT.unpack_from(data, pos)
+        pos += COUNT.size
+        if n_definitions == SESSION:
+            wall, monotonic = SESSION_BASE.unpack_from(data, pos)
+            pos += SESSION_BASE.size
+            offset = wall - monotonic
+            # The ids of a new session are interned again from 0
+            sources = {}
+            text_sources = set()
+            texts = {}
+            continue
+        for _ in range(n_definitions):
+            kind, ident, length = DEFINITION.unpack_from(data, pos)
+            pos += DEFINITION.size
+            name = data[pos:pos + length].decode()
+            pos += length
+            if kind == TEXT:
+                texts[ident] = name
+            else:
+                sources[ident] = name
+                if kind == TEXT_SOURCE:
+                    text_sources.add(ident)
+        (n_records,) = COUNT.unpack_from(data, pos)
+        pos += COUNT.size
+        for t, ident, value in RECORD.iter_unpack(data[pos:pos + n_records * RECORD.size]):
+            if ident in text_sources:
+                value = texts[int(value)]
+            records.append((t + offset, sources[ident], value))
+        pos += n_records * RECORD.size
+    return sources, texts, records
+
+
+def stage_timings(records):
+    """
+    :return: list of (stage, start time, duration or None if not finished),
+    times relative to the first record
+    """
+    if not records:
+        return []
+    t0 = records[0][0]
+    stages = []
+    open_stages = {}
+    for t, source, value in records:
+        if source == STAGE_START:
+            open_stages[value] = len(stages)
+            stages.append([value, t - t0, None])
+        elif source == STAGE_END and value in open_stages:
+            entry = stages[open_stages.pop(value)]
+            entry[2] = t - t0 - entry[1]
+    return [tuple(entry) for entry in stages]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read a telemetry log")
+    parser.add_argument("path")
+    parser.add_argument("--trace", action="store_true", help="print all records")
+    parser.add_argument("--source", action="append", help="only trace these sources")
+    args = parser.parse_args()
+
+    _, _, records = read_log(args.path)
+    records.sort(key=lambda r: r[0])
+    if args.trace:
+        t0 = records[0][0] if records else 0
+        for t, source, value in records:
+            if args.source and source not in args.source:
+                continue
+            print(f"{t - t0:10.3f} {source:20s} {value!r}")
+        return
+
+    # Sources by name, the ids of the log are per session
+    print(f"{len(records)} records, {len({source for _, source, _ in records})} sources, all sessions")
+    print(f"{'stage':30s} {'start s':>8s} {'duration s':>10s}")
+    for stage, start, duration in stage_timings(records):
+        print(f"{stage:30s} {start:>8.2f} {duration if duration is not None else float('nan'):>10.2f}")
+    counts = defaultdict(int)
+    for _, source, _ in records:
+        counts[source] += 1
+    print(f"{'source':30s} {'records':>8s}")
+    for source, count in sorted(counts.items(), key=lambda item: -item[1]):
+        print(f"{source:30s} {count:>8d}")
+
+
+if __name__ == "__main__":
+    main()
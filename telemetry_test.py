@@ -0,0 +1,35 @@
+# This test file checks the telemetry recorder without the hat.
+# run this script, or pytest, to verify that texts beyond the table limit are
+# recorded as the overflow text.
+
+import os
+from pathlib import Path
+import sys
+import tempfile
+
+# The game modules import each other by name
+sys.path.insert(0, str(Path(__file__).resolve().parent / "src" / "sola_board_game"))
+
+from telemetry import Telemetry, read_log, MAX_TEXTS, OVERFLOW_TEXT
+
+
+def test_text_overflow():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "telemetry.bin")
+        telemetry = Telemetry(path)
+        n_texts = MAX_TEXTS + 10
+        for i in range(n_texts):
+            telemetry.text("distance", f"{i} cm")
+        telemetry.flush()
+        assert len(telemetry.texts) == MAX_TEXTS + 1
+
+        _, texts, records = read_log(path)
+        values = [value for _, _, value in records]
+        assert len(values) == n_texts
+        assert values[:MAX_TEXTS] == [f"{i} cm" for i in range(MAX_TEXTS)]
+        assert values[MAX_TEXTS:] == [OVERFLOW_TEXT] * (n_texts - MAX_TEXTS)
+
+
+if __name__ == "__main__":
+    test_text_overflow()
+    print("telemetry ok")